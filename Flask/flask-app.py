@@ -1,9 +1,14 @@
-from flask import Flask, render_template, send_from_directory, abort, request, jsonify, send_file, session, url_for, Response, stream_with_context
+import time
+STARTUP_TIMINGS = {} # Seconds spent on each step of starting the server (see report_startup_times)
+startup_clock = time.perf_counter()
+
+from flask import Flask, render_template, abort, request, jsonify, send_file, session, url_for, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy
 from flask_bcrypt import Bcrypt
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 
-import os, json, warnings
+import os, json, warnings, re, struct, hashlib, shutil, inspect
 import numpy as np
 import soundfile as sf
 from typing import Union, Literal
@@ -11,25 +16,26 @@ from typing import Union, Literal
 # Filter out specific torch warnings
 warnings.filterwarnings('ignore', category=UserWarning, module='torch.nn.utils.weight_norm')
 
-from groq import Groq
+from groq import Groq, BadRequestError
 from dotenv import load_dotenv
 
-from transformers import VitsModel, AutoTokenizer
-import torch
-import scipy.io.wavfile as wav
-
-import torchaudio
-from audiocraft.models import AudioGen, MusicGen
-from audiocraft.data.audio import audio_write
-
-from diffusers import AutoPipelineForText2Image, DPMSolverMultistepScheduler
+# NOTE: The ML libraries (torch, transformers, audiocraft, diffusers...) take a long time to import so they are only
+# imported when a model is first needed, see import_ml_stack
+torch = None
+wav = None
+torchaudio = None
+VitsModel = AutoTokenizer = None
+AudioGen = MusicGen = audio_write = None
+AutoPipelineForText2Image = DPMSolverMultistepScheduler = None
 
 from PIL import Image
-from io import BytesIO
-import base64
 
-import sqlite3
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, Any, Iterator
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+import gc, math
 
 """
 TODO: 
@@ -38,6 +44,8 @@ users
 
 """
 
+STARTUP_TIMINGS['import web stack'] = time.perf_counter() - startup_clock
+
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 STATIC_DIR = os.path.join(SCRIPT_DIR, 'static')
 USERDATA_DIR = os.path.join(STATIC_DIR, 'userdata')
@@ -47,6 +55,62 @@ AUDIO_DIR = os.path.join(STATIC_DIR, 'audio')
 DEBUG = False
 # I have also been informed that the reloader causes issues with groq
 
+# Generated files are cached by their inputs so that identical requests (from any user or story) reuse the same file
+GENERATION_CACHE_DIR = os.path.join(SCRIPT_DIR, 'generation_cache')
+GENERATION_CACHE_MAX_MB = int(os.getenv("GENERATION_CACHE_MAX_MB", 4096)) # Least recently used files are removed above this size
+GENERATION_CACHE_ENABLED = True
+
+# Users that can see the server statistics endpoints (comma separated usernames)
+ADMIN_USERS = {username.strip() for username in os.getenv("ADMIN_USERS", "").split(",") if username.strip()}
+
+# Web only mode serves the pages and the chat without loading any models (story jobs are left for a generation server)
+WEB_ONLY = os.getenv("WEB_ONLY", "false").lower() == "true"
+
+# Batch sizes for story asset generation (lower these if the models run out of memory)
+TTS_BATCH_SIZE = 8 # Paragraphs synthesised per TTS forward pass
+TTS_STREAM_GAP_SECONDS = 0.15 # Silence between sentences when streaming TTS
+AUDIO_BATCH_SIZE = 4 # Sound effect descriptions per AudioGen generate call
+IMAGE_BATCH_SIZE = 4 # Image prompts per SDXL-Turbo pipeline call
+
+# Concurrent chat requests for the same model are collected for a short window and run as one batch (of at most the batch size above)
+TTS_BATCH_WINDOW_MS = int(os.getenv("TTS_BATCH_WINDOW_MS", 20))
+IMAGE_BATCH_WINDOW_MS = int(os.getenv("IMAGE_BATCH_WINDOW_MS", 30))
+
+# Precomputed image sizes (derivatives are stored in <story>/derivatives as <image>_<size>.webp)
+CATALOGUE_THUMBNAIL_SIZE = 256 # Size of the thumbnails shown on the catalogue pages
+DISPLAY_IMAGE_SIZES = [512, 256] # Sizes of the images shown on the story page
+IMAGE_DERIVATIVE_QUALITY = 80 # WebP/AVIF quality
+IMAGE_DERIVATIVE_AVIF = False # Also create AVIF derivatives (requires Pillow with AVIF support)
+CATALOGUE_PAGE_SIZE = 24 # Stories per page of the public catalogue (further pages are loaded as the user scrolls)
+MANIFEST_CACHE_SIZE = 256 # Number of parsed story manifests kept in memory
+
+# Story audio is encoded in the background after generation (the WAV files are kept as a fallback for older browsers)
+AUDIO_ENCODINGS = ['opus'] # Formats to encode story audio to ('opus' for streaming, 'flac' for a lossless master)
+OPUS_COMPRESSION_LEVEL = 0.5 # Opus compression level passed to libsndfile (0 = highest quality, 1 = smallest file)
+
+# The narration, sound effects and music are mixed into a single soundtrack so the viewer only streams one file
+SOUNDTRACK_SAMPLE_RATE = 32000 # Sample rate of the mixed soundtrack (the music model's rate, speech and sound effects are upsampled)
+SOUNDTRACK_GAP_SECONDS = 0.3 # Silence between clips
+SOUNDTRACK_INCLUDE_MUSIC = True # Mix the background music into the soundtrack
+MUSIC_VOLUME = 0.1 # Volume of the music bed during sound effects and gaps
+MUSIC_DUCKED_VOLUME = 0.04 # Volume of the music bed while the narration is playing
+
+# The story completion is requested while the safety check runs and is only sent to the client if the prompt is safe
+SPECULATIVE_COMPLETION = True
+STREAM_STORY_STRUCTURE = True # Parse the story structure while it is being generated and start generating each asset as soon as its prompt is complete
+GUARD_CACHE_TTL = 60 * 10 # Seconds a safety verdict is reused for the same prompt
+GUARD_CACHE_SIZE = 1024 # Number of safety verdicts kept in memory
+
+# Admission control: requests are rejected (429) once their model's queue is full, accelerator time is limited per user
+MODEL_QUEUE_LIMITS = {'tts': 16, 'audio': 4, 'image': 8} # Chat requests waiting for or using each model
+STORY_QUEUE_LIMIT = 20 # Story and regeneration jobs waiting or running
+USER_STORY_LIMIT = 2 # Story and regeneration jobs a single user can have waiting or running
+USER_GPU_QUOTA_SECONDS = int(os.getenv("USER_GPU_QUOTA_SECONDS", 900)) # Accelerator seconds each user can use per quota window
+USER_GPU_QUOTA_WINDOW = 60 * 60 # Seconds
+
+# Models are loaded on first use, once loading another model would exceed this budget the least recently used ones are evicted
+MODEL_MEMORY_BUDGET_MB = int(os.getenv("MODEL_MEMORY_BUDGET_MB", 14000)) # Accelerator memory available to the models
+
 #-------------------------------------------------------Server Setup-------------------------------------------------------#
 
 load_dotenv() # Load environment variables (API keys, etc.)
@@ -68,22 +132,505 @@ socketio = SocketIO(app)
 if not DEBUG:
     client = Groq(api_key=os.getenv("GROQ_KEY")) # Create a GROQ client for chat completion
 
-tts_model = VitsModel.from_pretrained("facebook/mms-tts-eng") # https://huggingface.co/facebook/mms-tts-eng  Consider wavnet? I think it's better but it requires use of google cloud services
-tokeniser = AutoTokenizer.from_pretrained("facebook/mms-tts-eng") 
+#-----------------------------------------------------Scheduler-----------------------------------------------------#
 
-image_model = "stabilityai/sdxl-turbo" # https://huggingface.co/stabilityai/sdxl-turbo
+PRIORITY_CLASSES = ['interactive', 'background'] # Highest priority first (chat requests go before story assets)
+
+class AdmissionError(Exception):
+    """Raised when the scheduler rejects a request, retry_after is the suggested wait in seconds"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class GenerationScheduler:
+    """
+    Admission control, priority classes and per-user accelerator quotas for model requests
+
+    - Chat requests are admitted into a bounded queue per model and rejected with a retry time once it is full
+    - Accelerator models are used one at a time, waiting interactive requests always go before background work
+    - Accelerator time is charged to the users of the current context (split evenly for batches) and limited per user
+      over a sliding window
+
+    The users and priority class are set per thread with context(), bind() carries them over to executor threads
+    """
+    def __init__(self, queue_limits: dict[str, int], quota_seconds: int, quota_window: int, accelerator_slots: int = 1):
+        self.queue_limits = queue_limits
+        self.quota_seconds = quota_seconds
+        self.quota_window = quota_window
+        self.slots = accelerator_slots
+        self.queued = {model: 0 for model in queue_limits}
+        self.rejected = {}
+        self.service_times = {} # Model (or 'story') -> moving average of the seconds per request
+        self.usage: dict[str, deque] = {} # Username -> (time, accelerator seconds) within the quota window
+        self.lock = threading.Lock()
+
+        self.active = 0 # Callers using the accelerator
+        self.waiting = {priority: 0 for priority in PRIORITY_CLASSES}
+        self.accelerator_seconds = {priority: 0.0 for priority in PRIORITY_CLASSES}
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+    @contextmanager
+    def context(self, users: list[str], priority: Literal['interactive', 'background'] = 'interactive'):
+        """Context manager that sets who the current thread's model calls are for and their priority class"""
+        previous = (getattr(self.local, 'users', []), getattr(self.local, 'priority', 'interactive'))
+        self.local.users = [user for user in users if user]
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.users, self.local.priority = previous
+
+    def bind(self, func: Callable) -> Callable:
+        """Wrap func so that it runs with the current thread's context (use when submitting work to another thread)"""
+        users, priority = getattr(self.local, 'users', []), getattr(self.local, 'priority', 'interactive')
+        def run(*args, **kwargs):
+            with self.context(users, priority):
+                return func(*args, **kwargs)
+        return run
+
+    def record(self, model: str, seconds: float) -> None:
+        """
+        Update the average time a request for a model takes (used for the Retry-After estimates)
+        Only the time the model is held should be recorded, not the time spent queueing or sending the response
+        """
+        with self.lock:
+            average = self.service_times.get(model)
+            self.service_times[model] = seconds if average is None else 0.8 * average + 0.2 * seconds
+
+    def estimate_wait(self, model: str, queued: int, workers: int = 1) -> int:
+        """Estimate the seconds until a queue with queued requests has room"""
+        return max(1, math.ceil(self.service_times.get(model, 5.0) * max(1, queued) / max(1, workers)))
+
+    def gpu_seconds(self, username: str) -> float:
+        """Get the accelerator seconds a user has used within the quota window"""
+        with self.lock:
+            usage = self.usage.get(username)
+            if not usage:
+                return 0.0
+            while usage and usage[0][0] < time.time() - self.quota_window:
+                usage.popleft()
+            return sum(seconds for _, seconds in usage)
+
+    def check_quota(self, username: str) -> None:
+        """Raise an AdmissionError if a user has used their accelerator quota"""
+        used = self.gpu_seconds(username)
+        if used < self.quota_seconds:
+            return
+
+        # Wait until enough of the usage has left the window
+        excess = used - self.quota_seconds
+        retry_after = 1
+        with self.lock:
+            for used_at, seconds in self.usage.get(username, []):
+                excess -= seconds
+                retry_after = max(1, math.ceil(used_at + self.quota_window - time.time()))
+                if excess < 0:
+                    break
+        raise AdmissionError(f"GPU quota used ({used:.0f}s of {self.quota_seconds}s per {self.quota_window // 60} minutes)", retry_after)
+
+    def admit(self, model: str, username: str, uses_accelerator: bool = False) -> str:
+        """
+        Admit a request into a model's queue (call release with the returned ticket once it is done)
+        Raises an AdmissionError if the queue is full or the user is over their quota
+        """
+        if uses_accelerator:
+            self.check_quota(username)
+        with self.lock:
+            if self.queued[model] >= self.queue_limits[model]:
+                self.rejected[model] = self.rejected.get(model, 0) + 1
+                retry_after = self.estimate_wait(model, self.queued[model])
+                log_to_console(f"Rejected {model} request from {username}, queue full", tag="SCHEDULER", spacing=0)
+                raise AdmissionError(f"The server is busy, too many {model} requests are waiting", retry_after)
+            self.queued[model] += 1
+        return model
+
+    def release(self, ticket: str) -> None:
+        """Remove a finished request from its model's queue"""
+        with self.lock:
+            self.queued[ticket] -= 1
+
+    @contextmanager
+    def admission(self, model: str, username: str, uses_accelerator: bool = False):
+        """Context manager version of admit and release"""
+        ticket = self.admit(model, username, uses_accelerator)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    @contextmanager
+    def accelerator(self):
+        """
+        Context manager that waits for the accelerator in the current priority class and charges the time it is held
+        (nested calls from the same thread don't wait again)
+        """
+        if getattr(self.local, 'holding', False):
+            yield
+            return
+
+        priority = getattr(self.local, 'priority', 'interactive')
+        higher = PRIORITY_CLASSES[:PRIORITY_CLASSES.index(priority)]
+        with self.condition:
+            self.waiting[priority] += 1
+            self.condition.wait_for(lambda: self.active < self.slots and not any(self.waiting[other] for other in higher))
+            self.waiting[priority] -= 1
+            self.active += 1
+
+        self.local.holding = True
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            self.local.holding = False
+            with self.condition:
+                self.active -= 1
+                self.accelerator_seconds[priority] += seconds
+                self.condition.notify_all()
+            self.charge(getattr(self.local, 'users', []), seconds)
+
+    def charge(self, users: list[str], seconds: float) -> None:
+        """Charge accelerator time to users (split evenly)"""
+        if not users:
+            return
+        with self.lock:
+            for user in users:
+                self.usage.setdefault(user, deque()).append((time.time(), seconds / len(users)))
+
+    def stats(self) -> dict:
+        """Get the queue lengths, rejections, accelerator time per priority class and per-user usage"""
+        users = list(self.usage)
+        usage = {user: self.gpu_seconds(user) for user in users}
+        with self.lock, self.condition:
+            return {
+                'queued': dict(self.queued),
+                'queue_limits': dict(self.queue_limits),
+                'rejected': dict(self.rejected),
+                'service_seconds': dict(self.service_times),
+                'accelerator_waiting': dict(self.waiting),
+                'accelerator_seconds': dict(self.accelerator_seconds),
+                'quota_seconds': self.quota_seconds,
+                'user_gpu_seconds': usage
+            }
+
+generation_scheduler = GenerationScheduler(MODEL_QUEUE_LIMITS, USER_GPU_QUOTA_SECONDS, USER_GPU_QUOTA_WINDOW)
+
+#-----------------------------------------------------Model Registry-----------------------------------------------------#
+
+ml_stack_lock = threading.Lock()
+
+def import_ml_stack() -> None:
+    """
+    Import the ML libraries used by the models (only the first call does anything)
+    The time taken by each import is recorded in STARTUP_TIMINGS
+    """
+    global torch, wav, torchaudio, VitsModel, AutoTokenizer, AudioGen, MusicGen, audio_write, AutoPipelineForText2Image, DPMSolverMultistepScheduler
 
+    if WEB_ONLY:
+        raise RuntimeError("Generation is disabled in web only mode")
 
-audio_model = None 
-music_model = None
-if not DEBUG: # Safety - See above (DEBUG flag)
-    audio_model = AudioGen.get_pretrained('facebook/audiogen-medium') # https://github.com/facebookresearch/audiocraft/blob/main/docs/AUDIOGEN.md  https://huggingface.co/facebook/audiogen-medium
+    with ml_stack_lock:
+        if torch is not None:
+            return
+
+        log_to_console("Importing ML libraries", tag="STARTUP", spacing=1)
+
+        clock = time.perf_counter()
+        import torch as torch_module
+        STARTUP_TIMINGS['import torch'] = time.perf_counter() - clock
+
+        clock = time.perf_counter()
+        from transformers import VitsModel, AutoTokenizer
+        import scipy.io.wavfile as wav
+        STARTUP_TIMINGS['import transformers'] = time.perf_counter() - clock
+
+        clock = time.perf_counter()
+        import torchaudio
+        from audiocraft.models import AudioGen, MusicGen
+        from audiocraft.data.audio import audio_write
+        STARTUP_TIMINGS['import audiocraft'] = time.perf_counter() - clock
+
+        clock = time.perf_counter()
+        from diffusers import AutoPipelineForText2Image, DPMSolverMultistepScheduler
+        STARTUP_TIMINGS['import diffusers'] = time.perf_counter() - clock
+
+        torch = torch_module # Assigned last so other threads only skip the imports once every module is available
+
+        log_to_console(f"ML libraries imported in {sum(STARTUP_TIMINGS[key] for key in STARTUP_TIMINGS if key.startswith('import ') and key != 'import web stack'):.2f}s", tag="STARTUP", spacing=1)
+
+def estimate_model_memory(model: Any) -> int:
+    """
+    Estimate the memory used by a model in bytes by adding up its parameters and buffers
+    Works for torch modules, diffusers pipelines, audiocraft models and tuples of these
+    """
+    if isinstance(model, (tuple, list)):
+        return sum(estimate_model_memory(item) for item in model)
+
+    if isinstance(model, torch.nn.Module):
+        modules = [model]
+    elif hasattr(model, 'components'): # Diffusers pipeline
+        modules = [component for component in model.components.values() if isinstance(component, torch.nn.Module)]
+    elif hasattr(model, '__dict__'): # Audiocraft models keep their modules as attributes (lm, compression_model)
+        modules = [value for value in vars(model).values() if isinstance(value, torch.nn.Module)]
+    else:
+        return 0
+
+    return sum(tensor.numel() * tensor.element_size() for module in modules for tensor in list(module.parameters()) + list(module.buffers()))
+
+class ModelEntry:
+    """
+    A model known to the registry
+
+    Parameters:
+    - name: Name used to request the model
+    - loader: Function that loads the model and returns it
+    - device: 'cuda' if the model lives on the accelerator (counts towards the budget), 'cpu' otherwise
+    - size_estimate_mb: Expected size of the model, used to make room before it is loaded for the first time
+    - offload: Optional function that moves the model to the CPU instead of unloading it when evicted
+    - restore: Function that moves an offloaded model back to the accelerator
+    """
+    def __init__(self, name: str, loader: Callable[[], Any], device: str = 'cuda', size_estimate_mb: int = 0,
+                 offload: Callable[[Any], Any] = None, restore: Callable[[Any], Any] = None):
+        self.name = name
+        self.loader = loader
+        self.device = device
+        self.size_bytes = size_estimate_mb * 1024 * 1024
+        self.offload = offload
+        self.restore = restore
+
+        self.model = None
+        self.offloaded = False # True if the model is in CPU memory after being evicted
+        self.load_lock = threading.Lock() # Held while the model is loaded, restored or evicted so only one of these happens at once
+        self.evicting = False # True once the model has been picked for eviction (stops it being picked twice)
+        self.in_use = 0 # Number of callers currently using the model (in use models are never evicted)
+        self.load_count = 0
+        self.evict_count = 0
+        self.load_seconds = 0.0 # Time spent in the most recent load
+        self.total_load_seconds = 0.0
+        self.unload_seconds = 0.0 # Time spent in the most recent eviction
+        self.last_used = None
+
+    @property
+    def resident(self) -> bool:
+        """Whether the model currently uses accelerator memory"""
+        return self.model is not None and not self.offloaded and self.device == 'cuda'
+
+class ModelRegistry:
+    """
+    Loads models on first use and keeps the accelerator memory they use within a budget
+
+    When a model is requested and loading it would exceed the budget, the least recently used models that are not in use
+    are offloaded to the CPU (if they support it) or unloaded (they will be reloaded from the disk cache when needed again)
+    """
+    def __init__(self, budget_mb: int):
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.entries: OrderedDict[str, ModelEntry] = OrderedDict() # Ordered from least to most recently used
+        self.lock = threading.RLock()
+
+    def register(self, name: str, loader: Callable[[], Any], **kwargs) -> None:
+        """Register a model without loading it (see ModelEntry for the keyword arguments)"""
+        self.entries[name] = ModelEntry(name, loader, **kwargs)
+
+    def resident_bytes(self) -> int:
+        """Get the accelerator memory used by the loaded models"""
+        return sum(entry.size_bytes for entry in self.entries.values() if entry.resident)
+
+    def make_room(self, needed_bytes: int, exclude: str) -> None:
+        """
+        Evict least recently used models until needed_bytes fits in the budget
+        The models are picked with the registry lock held but evicted after it has been released, as offloading takes seconds
+        """
+        with self.lock:
+            victims = []
+            freed = 0
+            for entry in list(self.entries.values()):
+                if self.resident_bytes() - freed + needed_bytes <= self.budget_bytes:
+                    break
+                if entry.name == exclude or not entry.resident or entry.in_use or entry.evicting:
+                    continue
+                entry.evicting = True
+                victims.append(entry)
+                freed += entry.size_bytes
+
+        for entry in victims:
+            self.evict(entry.name)
+
+        with self.lock:
+            if self.resident_bytes() + needed_bytes > self.budget_bytes:
+                log_to_console(f"Model memory budget exceeded ({(self.resident_bytes() + needed_bytes) / 1024**2:.0f}MB of {self.budget_bytes / 1024**2:.0f}MB), all other models are in use", tag="MODEL-REGISTRY", spacing=1)
+
+    def evict(self, name: str) -> None:
+        """Offload or unload a model (call without the registry lock held)"""
+        entry = self.entries[name]
+        try:
+            with entry.load_lock:
+                with self.lock:
+                    if not entry.resident or entry.in_use: # Used again since it was picked
+                        return
+                    model = entry.model
+
+                start = time.time()
+                if entry.offload:
+                    model = entry.offload(model)
+                    action = "Offloaded"
+                else:
+                    model = None
+                    action = "Unloaded"
+
+                with self.lock:
+                    entry.model = model
+                    entry.offloaded = model is not None
+                gc.collect()
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+
+                with self.lock:
+                    entry.unload_seconds = time.time() - start
+                    entry.evict_count += 1
+                log_to_console(f"{action} model {name} in {entry.unload_seconds:.2f}s", tag="MODEL-REGISTRY", spacing=1)
+        finally:
+            entry.evicting = False
+
+    def load(self, name: str) -> Any:
+        """
+        Get a model, loading or restoring it if necessary, and mark it as in use (see release)
+
+        Only the model's own load lock is held while it loads, the registry lock is just held for the bookkeeping
+        so other models can still be used in the meantime
+        """
+        entry = self.entries[name]
+        with entry.load_lock:
+            with self.lock:
+                self.entries.move_to_end(name)
+                entry.last_used = time.time()
+                entry.in_use += 1 # Stops other loads evicting the model before the caller has used it
+                if entry.model is not None and not entry.offloaded:
+                    return entry.model
+
+            try:
+                import_ml_stack()
+
+                if entry.device == 'cuda':
+                    self.make_room(entry.size_bytes, exclude=name)
+
+                start = time.time()
+                if entry.offloaded:
+                    model = entry.restore(entry.model)
+                    action = "Restored"
+                else:
+                    log_to_console(f"Loading model {name}", tag="MODEL-REGISTRY", spacing=1)
+                    model = entry.loader()
+                    action = "Loaded"
+            except BaseException:
+                self.release(name)
+                raise
+
+            with self.lock:
+                if action == "Loaded":
+                    entry.size_bytes = estimate_model_memory(model) or entry.size_bytes
+                entry.model = model
+                entry.offloaded = False
+                entry.load_seconds = time.time() - start
+                entry.total_load_seconds += entry.load_seconds
+                entry.load_count += 1
+                log_to_console(f"{action} model {name} ({entry.size_bytes / 1024**2:.0f}MB) in {entry.load_seconds:.2f}s", tag="MODEL-REGISTRY", spacing=1)
+
+            # The estimate used before the first load may have been too small
+            if entry.device == 'cuda':
+                self.make_room(0, exclude=name)
+
+            return model
+
+    def release(self, name: str) -> None:
+        """Mark a model returned by load as no longer in use"""
+        with self.lock:
+            self.entries[name].in_use -= 1
+            self.entries[name].last_used = time.time()
+
+    @contextmanager
+    def use(self, name: str):
+        """
+        Context manager that provides a model and prevents it from being evicted while it is in use
+        Accelerator models wait for their turn with the scheduler first (see GenerationScheduler.accelerator)
+
+        Example:
+            with model_registry.use('image') as image_pipe:
+                image_pipe(...)
+        """
+        with generation_scheduler.accelerator() if self.entries[name].device == 'cuda' else nullcontext():
+            model = self.load(name)
+            start = time.time()
+            try:
+                yield model
+            finally:
+                self.release(name)
+                generation_scheduler.record(name, time.time() - start) # A batched call counts as one request
+
+    def stats(self) -> dict:
+        """Get the memory usage and load/unload timings of every registered model"""
+        with self.lock:
+            return {
+                'budget_mb': self.budget_bytes / 1024**2,
+                'resident_mb': self.resident_bytes() / 1024**2,
+                'models': {
+                    entry.name: {
+                        'loaded': entry.model is not None,
+                        'offloaded': entry.offloaded,
+                        'device': entry.device,
+                        'size_mb': entry.size_bytes / 1024**2,
+                        'in_use': entry.in_use,
+                        'load_count': entry.load_count,
+                        'evict_count': entry.evict_count,
+                        'last_load_seconds': entry.load_seconds,
+                        'total_load_seconds': entry.total_load_seconds,
+                        'last_unload_seconds': entry.unload_seconds,
+                        'last_used': entry.last_used
+                    } for entry in self.entries.values()
+                }
+            }
+
+image_model = "stabilityai/sdxl-turbo" # https://huggingface.co/stabilityai/sdxl-turbo
+tts_model_name = "facebook/mms-tts-eng" # https://huggingface.co/facebook/mms-tts-eng
+audio_model_name = "facebook/audiogen-medium" # https://huggingface.co/facebook/audiogen-medium
+music_model_name = "facebook/musicgen-medium" # https://huggingface.co/facebook/musicgen-medium
+
+def load_tts_model() -> tuple:
+    """Load the TTS model and its tokeniser"""
+    tts_model = VitsModel.from_pretrained(tts_model_name) # Consider wavnet? I think it's better but it requires use of google cloud services
+    tokeniser = AutoTokenizer.from_pretrained(tts_model_name)
+    return tts_model, tokeniser
+
+def load_audio_model() -> Any:
+    """Load the sound effect model"""
+    if DEBUG:
+        raise ValueError("Audio generation is disabled in debug mode") # Safety - See above (DEBUG flag)
+    audio_model = AudioGen.get_pretrained(audio_model_name) # https://github.com/facebookresearch/audiocraft/blob/main/docs/AUDIOGEN.md
     audio_model.set_generation_params(duration=5)  # Length of audio in seconds (Will be overwritten by the duration parameter in the generate_sound_file function)
+    return audio_model
+
+def load_music_model() -> Any:
+    """Load the music model"""
+    if DEBUG:
+        raise ValueError("Audio generation is disabled in debug mode") # Safety - See above (DEBUG flag)
     #music_model = MusicGen.get_pretrained('facebook/musicgen-melody') # https://huggingface.co/facebook/musicgen-melody
-    music_model = MusicGen.get_pretrained('facebook/musicgen-medium') # Switched away from melody since it had features that were not needed (large caused memory errors) https://huggingface.co/facebook/musicgen-medium
+    music_model = MusicGen.get_pretrained(music_model_name) # Switched away from melody since it had features that were not needed (large caused memory errors)
     music_model.set_generation_params(duration=20)
+    return music_model
+
+def load_image_pipe() -> Any:
+    """Load the image generation pipeline"""
+    if DEBUG:
+        raise ValueError("Image generation is disabled in debug mode")
     scheduler = DPMSolverMultistepScheduler.from_pretrained(image_model, subfolder="scheduler")
-    image_pipe = AutoPipelineForText2Image.from_pretrained(image_model, scheduler=scheduler, torch_dtype=torch.float16, variant="fp16").to("cuda")
+    return AutoPipelineForText2Image.from_pretrained(image_model, scheduler=scheduler, torch_dtype=torch.float16, variant="fp16").to("cuda")
+
+model_registry = ModelRegistry(MODEL_MEMORY_BUDGET_MB)
+model_registry.register('tts', load_tts_model, device='cpu')
+model_registry.register('audio', load_audio_model, size_estimate_mb=3500)
+model_registry.register('music', load_music_model, size_estimate_mb=6000)
+# The image pipeline can be moved to the CPU and back, which is much faster than reloading it from disk
+model_registry.register('image', load_image_pipe, size_estimate_mb=7000, offload=lambda pipe: pipe.to("cpu"), restore=lambda pipe: pipe.to("cuda"))
 
 # User Model
 class User(db.Model):
@@ -95,20 +642,67 @@ class Story(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(80), nullable=False)
     data_path = db.Column(db.String(200), unique=True, nullable=False)
-    isPublic = db.Column(db.Boolean, nullable=False)
+    isPublic = db.Column(db.Boolean, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # Stored when the story is committed so that the catalogue pages don't need to read the story files
+    paragraph_count = db.Column(db.Integer, nullable=True)
+    thumbnail = db.Column(db.String(80), nullable=True) # File name of the catalogue thumbnail (see find_story_image)
+    thumbnail_version = db.Column(db.Integer, nullable=True) # Modification time of the thumbnail, used in its URL
+    created_at = db.Column(db.Float, nullable=True, default=time.time)
+
+class GenerationJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-
-def add_story_to_db(title: str, data_path: str, isPublic: bool, user_id: int) -> int:
+    kind = db.Column(db.String(20), nullable=True, default='story') # story or regenerate (older jobs have no kind and are stories)
+    target_assets = db.Column(db.JSON, nullable=True) # Assets a regenerate job should replace, 'missing' for missing and corrupt ones, None for all
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True) # queued, running, complete, failed
+    story_content = db.Column(db.Text, nullable=False)
+    data_path = db.Column(db.String(200), nullable=False)
+    story_id = db.Column(db.Integer, db.ForeignKey('story.id'), nullable=True) # Set once the story has been committed
+    completed_assets = db.Column(db.JSON, nullable=False, default=list) # Checkpointed asset names (e.g. paragraph_1, image_2)
+    message = db.Column(db.String(200), nullable=True) # Latest progress message
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
+    updated_at = db.Column(db.Float, nullable=False, default=time.time)
+
+def add_story_to_db(title: str, data_path: str, isPublic: bool, user_id: int, paragraph_count: int = None) -> int:
     """
     Add a story to the database
     
     Returns:
     - The ID of the newly added story
     """
-    new_story = Story(title=title, data_path=data_path, isPublic=isPublic, user_id=user_id)
+    thumbnail, thumbnail_version = find_story_thumbnail(data_path)
+    new_story = Story(title=title, data_path=data_path, isPublic=isPublic, user_id=user_id, paragraph_count=paragraph_count,
+                      thumbnail=thumbnail, thumbnail_version=thumbnail_version, created_at=time.time())
     db.session.add(new_story)
     db.session.commit()
-    return Story.query.filter_by(data_path=data_path).first().id
+    return new_story.id
+
+def update_story_metadata(story_id: int, paragraph_count: int = None) -> None:
+    """
+    Refresh the thumbnail reference (and optionally the paragraph count) of a story in the database
+    """
+    story = db.session.get(Story, story_id)
+    story.thumbnail, story.thumbnail_version = find_story_thumbnail(story.data_path)
+    if paragraph_count is not None:
+        story.paragraph_count = paragraph_count
+    db.session.commit()
+
+def get_user_stories(user_id: int) -> list[dict]:
+    """
+    Get the stories of a user from the database in the order they were created
+    """
+    stories = Story.query.filter_by(user_id=user_id).order_by(Story.id).all()
+    return [{
+        'id': story.id,
+        'title': story.title,
+        'isPublic': story.isPublic,
+        'paragraph_count': story.paragraph_count,
+        'thumbnail': story.thumbnail,
+        'thumbnail_version': story.thumbnail_version,
+        'created_at': story.created_at
+    } for story in stories]
 
 def change_story_privacy(story_id: int, isPublic: bool) -> None:
     """
@@ -126,9 +720,13 @@ def get_story_data(story_id: int) -> dict:
     - Data path
     - isPublic flag
     - Username of the author
+
+    Raises a ValueError if the story doesn't exist
     """
-    story = Story.query.filter_by(id=story_id).first()
-    username = User.query.filter_by(id=story.user_id).first().username
+    row = db.session.query(Story, User.username).join(User, Story.user_id == User.id).filter(Story.id == story_id).first()
+    if row is None:
+        raise ValueError(f"Story {story_id} not found")
+    story, username = row
     return {
         'title': story.title,
         'data_path': story.data_path,
@@ -136,31 +734,159 @@ def get_story_data(story_id: int) -> dict:
         'username': username
     }
 
-def get_story_id(title: str, user_id: int) -> Union[int, None]:
+def get_public_stories_page(before_id: int = None, limit: int = CATALOGUE_PAGE_SIZE) -> tuple[list[dict], Union[int, None]]:
+    """
+    Get a page of public stories, newest first, using the story ID as the cursor
+    Filtering on the ID instead of using an offset keeps every page as cheap as the first one
+
+    Parameters:
+    - before_id: Only return stories with an ID lower than this (the cursor returned with the previous page)
+    - limit: The maximum number of stories to return
+
+    Returns:
+    - The stories (ID, title, data path, privacy, thumbnail and author username)
+    - The cursor for the next page, or None if this is the last page
+    """
+    query = db.session.query(Story, User.username).join(User, Story.user_id == User.id).filter(Story.isPublic.is_(True))
+    if before_id is not None:
+        query = query.filter(Story.id < before_id)
+
+    rows = query.order_by(Story.id.desc()).limit(limit + 1).all() # One extra row tells us if there is another page
+    story_data = [{
+        'id': story.id,
+        'title': story.title,
+        'data_path': story.data_path,
+        'isPublic': story.isPublic,
+        'thumbnail': story.thumbnail,
+        'thumbnail_version': story.thumbnail_version,
+        'username': username
+    } for story, username in rows[:limit]]
+
+    next_cursor = story_data[-1]['id'] if len(rows) > limit else None
+    return story_data, next_cursor
+
+def create_generation_job(user_id: int, username: str, story_content: str, data_path: str) -> int:
+    """
+    Add a story generation job to the database
+    Raises an AdmissionError if the job can't be queued (see admit_story_job)
+
+    Returns:
+    - The ID of the newly added job
+    """
+    with job_lock: # The admission check and the insert happen together so concurrent requests can't both pass the check
+        admit_story_job(user_id, username)
+        job = GenerationJob(user_id=user_id, story_content=story_content, data_path=data_path, status='queued', completed_assets=[], message="Story queued...")
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+def merge_regeneration_targets(current: Union[list[str], str, None], new: Union[list[str], str, None]) -> Union[list[str], str, None]:
     """
-    Get the ID of a story from the database
+    Combine the target assets of two regeneration requests
+    Lists of assets are joined, any other combination regenerates every asset (None) as that covers both requests
     """
-    story = Story.query.filter_by(title=title, user_id=user_id).first()
-    if story:
-        return story.id
+    if current == new:
+        return current
+    if isinstance(current, list) and isinstance(new, list):
+        return current + [asset for asset in new if asset not in current]
     return None
 
-def get_all_stories() -> list[dict]:
+def regeneration_targets_cover(current: Union[list[str], str, None], new: Union[list[str], str, None]) -> bool:
+    """Check whether a regeneration job with the current target assets also regenerates the new ones"""
+    if current is None or current == new:
+        return True
+    return isinstance(current, list) and isinstance(new, list) and set(new) <= set(current)
+
+def create_regeneration_job(user_id: int, username: str, story_id: int, data_path: str, target_assets: Union[list[str], str, None]) -> Union[int, None]:
     """
-    Get all stories from the database
+    Add a job that regenerates the assets of an existing story to the database
+    If the story already has a regeneration job waiting, the target assets are added to that job instead.
+    If one is already running it is only returned when it regenerates the requested assets
+    Raises an AdmissionError if a new job is needed but can't be queued (see admit_story_job)
+
+    Returns:
+    - The ID of the job, or None if a running job doesn't cover the requested assets
     """
-    stories = Story.query.all()
-    story_data = []
-    for story in stories:
-        username = User.query.filter_by(id=story.user_id).first().username
-        story_data.append({
-            'title': story.title,
-            'data_path': story.data_path,
-            'isPublic': story.isPublic,
-            'username': username
-        })
-    return story_data
+    with job_lock: # Stops the worker claiming the job while its targets are merged
+        job = GenerationJob.query.filter(GenerationJob.kind == 'regenerate', GenerationJob.story_id == story_id,
+                                         GenerationJob.status.in_(['queued', 'running'])).first()
+        if job and job.status == 'queued':
+            update_generation_job(job.id, target_assets=merge_regeneration_targets(job.target_assets, target_assets))
+            return job.id
+        if job:
+            return job.id if regeneration_targets_cover(job.target_assets, target_assets) else None
+
+        admit_story_job(user_id, username)
+        job = GenerationJob(user_id=user_id, kind='regenerate', target_assets=target_assets, story_content='', data_path=data_path,
+                            story_id=story_id, status='queued', completed_assets=[], message="Regeneration queued...")
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+def update_generation_job(job_id: int, **fields) -> None:
+    """
+    Update the given fields of a generation job in the database
+    """
+    job = db.session.get(GenerationJob, job_id)
+    for field, value in fields.items():
+        setattr(job, field, value)
+    job.updated_at = time.time()
+    db.session.commit()
 
+def get_job_data(job_id: int) -> Union[dict, None]:
+    """
+    Get the status of a generation job from the database
+    Data includes:
+    - Job ID and status
+    - Latest progress message and error (if any)
+    - Checkpointed assets
+    - Username of the owner
+    - URL of the story once it has been committed
+    """
+    job = db.session.get(GenerationJob, job_id)
+    if not job:
+        return None
+    username = User.query.filter_by(id=job.user_id).first().username
+    return {
+        'job_id': job.id,
+        'kind': job.kind or 'story',
+        'target_assets': job.target_assets,
+        'status': job.status,
+        'message': job.message,
+        'error': job.error,
+        'completed_assets': job.completed_assets or [],
+        'username': username,
+        'url': f'/story-{job.story_id}' if job.story_id else None,
+        'created_at': job.created_at,
+        'updated_at': job.updated_at
+    }
+
+
+def get_startup_report() -> dict:
+    """
+    Get the time spent importing libraries and loading models
+    """
+    model_stats = model_registry.stats()['models']
+    return {
+        'web_only': WEB_ONLY,
+        'imports': {step: seconds for step, seconds in STARTUP_TIMINGS.items() if step.startswith('import ')},
+        'steps': {step: seconds for step, seconds in STARTUP_TIMINGS.items() if not step.startswith('import ')},
+        'model_loads': {name: stats['total_load_seconds'] for name, stats in model_stats.items() if stats['load_count']},
+        'capabilities': {
+            'libsndfile_version': sf.__libsndfile_version__,
+            'opus_compression_level': SOUNDFILE_COMPRESSION_LEVEL
+        }
+    }
+
+def report_startup_times() -> None:
+    """Log the startup time report to the console"""
+    report = get_startup_report()
+    log_to_console("Startup time report", tag="STARTUP", spacing=1)
+    for section in ['imports', 'steps', 'model_loads']:
+        for step, seconds in report[section].items():
+            log_to_console(f"{step}: {seconds:.2f}s", tag="STARTUP", spacing=0)
+    for capability, value in report['capabilities'].items():
+        log_to_console(f"{capability}: {value}", tag="STARTUP", spacing=0)
 
 def log_to_console(message: str, tag: Union[str | None] = None, spacing: int = 0) -> None:
     """Log a message to the console"""
@@ -176,15 +902,36 @@ def create_tables(db: SQLAlchemy) -> None:
     log_to_console("Creating tables in the database", tag="DATABASE", spacing=1)
     db.create_all()
 
+    # create_all doesn't add columns or indexes to tables that already exist
+    add_missing_columns(db)
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+def add_missing_columns(db: SQLAlchemy) -> None:
+    """Add columns that were added to the models after their table was created (new columns must be nullable)"""
+    inspector = sqlalchemy.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            log_to_console(f"Adding column {column.name} to table {table.name}", tag="DATABASE", spacing=0)
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(sqlalchemy.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
 def init_db() -> None:
     """Initialise the database"""
     if not os.path.exists(os.path.join(USERDATA_DIR, 'users.db')):
         log_to_console("User Database not found.", tag="DATABASE", spacing=1)
-        with app.app_context():
-            create_tables(db)
     else:
         log_to_console("User Database found.", tag="DATABASE", spacing=1)
 
+    # create_all only creates missing tables, so this also adds tables introduced after the database was created
+    with app.app_context():
+        create_tables(db)
+
 #-----------------------------------------------------Helper Functions-----------------------------------------------------#
 
 def create_user(user_name: str, password: str) -> None:
@@ -247,82 +994,730 @@ def debug_stories() -> None:
     for story in stories:
         log_to_console(f"Story: {story.title}, Path: {story.data_path}, Public: {story.isPublic}, User ID: {story.user_id}", tag="DEBUG-STORIES", spacing=0)
 
-def generate_tts_file(text: str, output_path: str) -> None:
+#-----------------------------------------------------Generation Cache-----------------------------------------------------#
+
+GENERATION_MODELS = {'tts': tts_model_name, 'audio': audio_model_name, 'music': music_model_name, 'image': image_model}
+GENERATION_CACHE_VERSION = 1 # Bump when the post-processing of generated files changes so old entries are no longer used
+
+def link_file(source: str, destination: str) -> None:
+    """
+    Make destination a copy of source without duplicating the data where possible
+    Tries a hardlink, then a reflink (copy on write filesystems), then falls back to a normal copy
+    The destination is replaced in one step so requests writing the same path at once never see a partial file
+    """
+    temp_path = f"{destination}.{threading.get_ident()}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        try:
+            import fcntl
+            with open(source, 'rb') as source_file, open(temp_path, 'wb') as destination_file:
+                fcntl.ioctl(destination_file.fileno(), 0x40049409, source_file.fileno()) # FICLONE
+        except (ImportError, OSError):
+            shutil.copyfile(source, temp_path)
+    os.replace(temp_path, destination)
+
+def prepare_output_path(output_path: str) -> None:
+    """
+    Create the directory of an output file and remove any existing file
+    Existing files may be links to cached files, writing to them in place would change the cached copy
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+def generation_cache_key(kind: Literal['tts', 'audio', 'music', 'image'], prompt: str, **params) -> str:
+    """
+    Get the cache key of a generation from the model, its parameters and the prompt
+    Pass a different seed to skip the cached file of the same prompt
+    Only images are generated from the seed, the speech and sound models sample unseeded so their files can't be reproduced from it
+    """
+    params.setdefault('seed', 0)
+    payload = json.dumps({
+        'version': GENERATION_CACHE_VERSION,
+        'kind': kind,
+        'model': GENERATION_MODELS[kind],
+        'prompt': prompt,
+        'params': params
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    """
+    Content addressed store of generated files, shared by every user and story
+
+    Files are stored under the hash of their inputs (see generation_cache_key) and hardlinked into place on a hit,
+    so identical assets share one copy on disk. The least recently used files are removed when the cache is over budget
+    """
+    def __init__(self, directory: str, max_mb: int, enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024
+        self.enabled = enabled
+        self.entries: OrderedDict[str, tuple[str, int]] = OrderedDict() # Key -> (path, size), least recently used first
+        self.total_bytes = 0 # Size of every file in entries, kept up to date so eviction doesn't have to sum the entries
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.counts = {} # Kind -> hits, misses and stores
+        self.evictions = 0
+
+    def get_path(self, key: str, extension: str) -> str:
+        """Get the path of a cached file (the file may not exist)"""
+        return os.path.join(self.directory, key[:2], f"{key}{extension}")
+
+    def load_index(self) -> None:
+        """Index the files already in the cache directory, oldest first (called on first use so startup isn't slowed down)"""
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.directory):
+            return
+
+        files = []
+        for folder in os.listdir(self.directory):
+            folder_path = os.path.join(self.directory, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for file_name in os.listdir(folder_path):
+                if file_name.endswith('.tmp'):
+                    continue
+                path = os.path.join(folder_path, file_name)
+                stat = os.stat(path)
+                files.append((stat.st_atime, os.path.splitext(file_name)[0], path, stat.st_size))
+
+        for _, key, path, size in sorted(files):
+            self.entries[key] = (path, size)
+            self.total_bytes += size
+        log_to_console(f"Indexed {len(self.entries)} cached files ({self.size_bytes() / 1024**2:.0f}MB)", tag="GENERATION-CACHE", spacing=1)
+
+    def size_bytes(self) -> int:
+        """Get the size of every file in the cache"""
+        return self.total_bytes
+
+    def drop(self, key: str) -> None:
+        """Remove an entry from the index (call with the lock held)"""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def count(self, kind: str, field: str) -> None:
+        """Increment a hit/miss/store counter"""
+        counts = self.counts.setdefault(kind, {'hits': 0, 'misses': 0, 'stores': 0})
+        counts[field] += 1
+
+    def materialise(self, key: str, output_path: str, kind: str) -> bool:
+        """
+        Link the cached file for key to output_path
+
+        Returns:
+        - True on a hit, False if the file has to be generated
+        """
+        if not self.enabled:
+            return False
+
+        with self.lock:
+            self.load_index()
+            entry = self.entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                self.drop(key)
+                self.count(kind, 'misses')
+                return False
+            self.entries.move_to_end(key)
+
+        # Linking happens outside the lock, so the file can be evicted in the meantime
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            link_file(entry[0], output_path)
+            os.utime(entry[0], (time.time(), os.path.getmtime(entry[0]))) # The access time keeps the LRU order across restarts, the modification time is left alone as linked story files share it
+        except FileNotFoundError:
+            with self.lock:
+                if self.entries.get(key) == entry:
+                    self.drop(key)
+                self.count(kind, 'misses')
+            return False
+
+        with self.lock:
+            self.count(kind, 'hits')
+        log_to_console(f"Cache hit ({kind}): {output_path}", tag="GENERATION-CACHE", spacing=0)
+        return True
+
+    def store(self, key: str, path: str, kind: str) -> None:
+        """Add a generated file to the cache"""
+        if not self.enabled or not os.path.exists(path):
+            return
+
+        cache_path = self.get_path(key, os.path.splitext(path)[1])
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        link_file(path, cache_path)
+
+        with self.lock:
+            self.load_index()
+            self.drop(key)
+            self.entries[key] = (cache_path, os.path.getsize(cache_path))
+            self.total_bytes += self.entries[key][1]
+            self.count(kind, 'stores')
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used files until the cache is within its size limit (call with the lock held)"""
+        while self.entries and self.total_bytes > self.max_bytes:
+            key, (path, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            if os.path.exists(path):
+                os.remove(path) # Stories linked to the file keep their copy
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """Get the hit rate of each kind of generation and the size of the cache"""
+        with self.lock:
+            self.load_index()
+            kinds = {}
+            for kind, counts in self.counts.items():
+                lookups = counts['hits'] + counts['misses']
+                kinds[kind] = {**counts, 'hit_rate': counts['hits'] / lookups if lookups else None}
+            hits = sum(counts['hits'] for counts in self.counts.values())
+            lookups = hits + sum(counts['misses'] for counts in self.counts.values())
+            return {
+                'enabled': self.enabled,
+                'files': len(self.entries),
+                'size_mb': self.size_bytes() / 1024**2,
+                'max_mb': self.max_bytes / 1024**2,
+                'evictions': self.evictions,
+                'hit_rate': hits / lookups if lookups else None,
+                'kinds': kinds
+            }
+
+generation_cache = GenerationCache(GENERATION_CACHE_DIR, GENERATION_CACHE_MAX_MB, GENERATION_CACHE_ENABLED)
+
+def materialise_cached(kind: Literal['tts', 'audio', 'image'], prompts: list[str], output_paths: list[str], file_suffix: str = '',
+                       on_saved: Callable[[str], None] = None, **params) -> tuple[list[str], list[str], list[str]]:
+    """
+    Link the cached files of a batch into place
+
+    file_suffix is added to the output paths to get the written file (audio_write adds .wav to the path it is given)
+    on_saved is called with the output path of every cache hit
+
+    Returns:
+    - The prompts that still have to be generated
+    - Their output paths
+    - Their cache keys
+    """
+    remaining_prompts, remaining_paths, keys = [], [], []
+    for prompt, output_path in zip(prompts, output_paths):
+        key = generation_cache_key(kind, prompt, **params)
+        if generation_cache.materialise(key, output_path + file_suffix, kind):
+            if on_saved:
+                on_saved(output_path)
+            continue
+        remaining_prompts.append(prompt)
+        remaining_paths.append(output_path)
+        keys.append(key)
+    return remaining_prompts, remaining_paths, keys
+
+#-----------------------------------------------------Request Coalescing-----------------------------------------------------#
+
+# Identical generation requests that arrive while one is already running (double clicks, several tabs or users asking
+# for the same thing) wait for that generation instead of running the model again
+
+class Flight:
+    """
+    A generation shared by every request with the same inputs
+
+    Streaming generations publish their chunks so that every waiter receives the whole stream, including the chunks
+    sent before it joined. cancelled is set once every waiter has left, generations should stop when they see it
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.waiters = 0
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.cancelled = threading.Event()
+        self.condition = threading.Condition()
+
+    def publish(self, chunk: Any) -> None:
+        """Send a chunk to every waiter"""
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, result: Any = None, error: Exception = None) -> None:
+        """Mark the generation as complete"""
+        with self.condition:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.condition.notify_all()
+
+    def wait(self) -> Any:
+        """Wait for the generation and get its result (raises the generation's error)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def iter_chunks(self) -> Iterator[Any]:
+        """Yield every published chunk as it arrives until the generation is complete"""
+        index = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.chunks) > index or self.done)
+                chunks = self.chunks[index:]
+                done = self.done
+            index += len(chunks)
+            yield from chunks
+            if done and index == len(self.chunks):
+                break
+        if self.error is not None:
+            raise self.error
+
+class SingleFlight:
+    """
+    Runs each generation once however many requests ask for it at the same time
+
+    Example:
+        with single_flight.attach(key, lambda flight: generate(...)) as flight:
+            result = flight.wait()
+    """
+    def __init__(self):
+        self.flights: dict[str, Flight] = {}
+        self.lock = threading.Lock()
+        self.counts = {'started': 0, 'coalesced': 0, 'cancelled': 0}
+
+    def join(self, key: str, func: Callable[[Flight], Any]) -> Flight:
+        """Join the running generation for key, or start func in a new thread if there isn't one"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = Flight(key)
+                self.flights[key] = flight
+                self.counts['started'] += 1
+                threading.Thread(target=self.run, args=(flight, func), name=f"flight-{key[:8]}", daemon=True).start()
+            else:
+                self.counts['coalesced'] += 1
+                log_to_console(f"Joined running generation {key[:8]} ({flight.waiters + 1} waiting)", tag="SINGLE-FLIGHT", spacing=0)
+            flight.waiters += 1
+        return flight
+
+    def leave(self, flight: Flight) -> None:
+        """Stop waiting for a generation, it is cancelled if nobody else is waiting"""
+        with self.lock:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                flight.cancelled.set()
+                self.counts['cancelled'] += 1
+                if self.flights.get(flight.key) is flight:
+                    del self.flights[flight.key] # New requests start a fresh generation
+                log_to_console(f"Every waiter left generation {flight.key[:8]}, cancelling", tag="SINGLE-FLIGHT", spacing=0)
+
+    def run(self, flight: Flight, func: Callable[[Flight], Any]) -> None:
+        """Run a generation and hand its result to the waiters"""
+        result, error = None, None
+        try:
+            result = func(flight)
+        except Exception as e:
+            error = e
+        finally:
+            with self.lock:
+                if self.flights.get(flight.key) is flight:
+                    del self.flights[flight.key]
+            flight.finish(result, error)
+
+    @contextmanager
+    def attach(self, key: str, func: Callable[[Flight], Any]):
+        """Context manager that joins a generation and leaves it when the request is done (or its client disconnects)"""
+        flight = self.join(key, func)
+        try:
+            yield flight
+        finally:
+            self.leave(flight)
+
+    def stats(self) -> dict:
+        """Get the number of generations started, joined and cancelled"""
+        with self.lock:
+            return {**self.counts, 'running': len(self.flights)}
+
+single_flight = SingleFlight()
+
+#-----------------------------------------------------Request Batching-----------------------------------------------------#
+
+class MicroBatcher:
+    """
+    Collects requests for a model that arrive close together and runs them as one batched call
+
+    The first request starts a window of window_ms, the batch runs when the window ends or max_batch requests have arrived.
+    batch_func takes the list of items and returns a list with the result of each one
+
+    Example:
+        tts_batcher.submit((text, output_path)).result()
+    """
+    def __init__(self, name: str, batch_func: Callable[[list], list], window_ms: int, max_batch: int):
+        self.name = name
+        self.batch_func = batch_func
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.queue: list[tuple[Any, Future]] = []
+        self.condition = threading.Condition()
+        self.worker = None
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item for the next batch"""
+        future = Future()
+        with self.condition:
+            self.queue.append((item, future))
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name=f"batcher-{self.name}", daemon=True)
+                self.worker.start()
+            self.condition.notify_all()
+        return future
+
+    def next_batch(self) -> list[tuple[Any, Future]]:
+        """Wait for the first item, then collect items until the window ends or the batch is full"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.queue)
+            deadline = time.monotonic() + self.window
+            while len(self.queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.queue[:self.max_batch]
+            self.queue = self.queue[self.max_batch:]
+        return batch
+
+    def run(self) -> None:
+        """Run batches until the server stops"""
+        while True:
+            batch = self.next_batch()
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            log_to_console(f"Running batch of {len(batch)} {self.name} requests", tag="MICRO-BATCH", spacing=0)
+            self.batches += 1
+            self.items += len(batch)
+            try:
+                results = self.batch_func([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def stats(self) -> dict:
+        """Get the number of batches run and their average size"""
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch': self.max_batch,
+            'batches': self.batches,
+            'items': self.items,
+            'average_batch': self.items / self.batches if self.batches else None
+        }
+
+def run_tts_requests(items: list[tuple[str, str]]) -> list[str]:
+    """Generate the TTS files of a batch of (text, output path) requests"""
+    generate_tts_batch([text for text, _ in items], [output_path for _, output_path in items])
+    return [output_path for _, output_path in items]
+
+def run_image_requests(items: list[tuple[str, str, str]]) -> list[str]:
+    """Generate the images of a batch of (description, output path, username) requests, the accelerator time is split between the users"""
+    with generation_scheduler.context([username for _, _, username in items]):
+        generate_image_batch([description for description, _, _ in items], [output_path for _, output_path, _ in items])
+    return [output_path for _, output_path, _ in items]
+
+tts_batcher = MicroBatcher('tts', run_tts_requests, TTS_BATCH_WINDOW_MS, TTS_BATCH_SIZE)
+image_batcher = MicroBatcher('image', run_image_requests, IMAGE_BATCH_WINDOW_MS, IMAGE_BATCH_SIZE)
+
+#-----------------------------------------------------Media Generation-----------------------------------------------------#
+
+def generate_tts_batch(texts: list[str], output_paths: list[str], batch_size: int = TTS_BATCH_SIZE, on_saved: Callable[[str], None] = None, seed: int = 0) -> None:
     """
-    Generate a TTS audio file from the given text and save it to the output path
+    Generate TTS audio files for several texts using batched forward passes and save them to the output paths
+
+    Texts are sorted by token length and split into buckets of at most batch_size so that padding is kept to a minimum,
+    the padded waveforms are then trimmed using the per-sample lengths returned by the model
+    on_saved is called with each output path once its file has been written (cached files are linked in without running the model)
+    """
+    if len(texts) != len(output_paths):
+        raise ValueError("Number of texts and output paths must match")
+
+    texts, output_paths, keys = materialise_cached('tts', texts, output_paths, on_saved=on_saved, seed=seed)
+    if not texts:
+        return
+
+    log_to_console(f"Generating {len(texts)} TTS audio files in batches of {batch_size}", tag="GENERATE-TTS-BATCH", spacing=1)
+
+    with model_registry.use('tts') as (tts_model, tokeniser):
+        # Sort by token length so each bucket contains texts of a similar size
+        token_lengths = [len(tokeniser(text).input_ids) for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: token_lengths[i])
+
+        batch_size = max(1, batch_size)
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            inputs = tokeniser([texts[i] for i in bucket], return_tensors="pt", padding=True)
+
+            with torch.no_grad():
+                output = tts_model(**inputs)
+
+            for row, i in enumerate(bucket):
+                length = int(output.sequence_lengths[row])
+                waveform = output.waveform[row, :length]
+                audio_data = (waveform.numpy() * 32767).astype(np.int16)  # Scale to 16-bit PCM
+                prepare_output_path(output_paths[i])
+                wav.write(output_paths[i], rate=tts_model.config.sampling_rate, data=audio_data)
+                generation_cache.store(keys[i], output_paths[i], 'tts')
+                log_to_console(f"Saved audio file to: {output_paths[i]}", tag="GENERATE-TTS-BATCH", spacing=0)
+                if on_saved:
+                    on_saved(output_paths[i])
+
+    log_to_console("Batch TTS generation complete", tag="GENERATE-TTS-BATCH", spacing=1)
+
+def split_sentences(text: str, min_length: int = 20) -> list[str]:
+    """
+    Split text into sentences for streaming TTS
+    Very short sentences are merged into the next one so that each model call has enough text to sound natural
     """
-    log_to_console(f"Generating TTS audio file for text: {text}", tag="GENERATE-TTS-FILE", spacing=1)
-    inputs = tokeniser(text, return_tensors="pt")
+    pieces = [piece.strip() for piece in re.split(r'(?<=[.!?])\s+|\n+', text) if piece.strip()]
+
+    sentences = []
+    buffer = ''
+    for piece in pieces:
+        buffer = f"{buffer} {piece}".strip()
+        if len(buffer) >= min_length:
+            sentences.append(buffer)
+            buffer = ''
+    if buffer:
+        sentences.append(buffer)
+    return sentences
+
+def create_streaming_wav_header(sample_rate: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    Create a WAV header for a stream of unknown length (the size fields are set to the maximum value)
+    """
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+            + b'data' + struct.pack('<I', 0xFFFFFFFF))
 
-    with torch.no_grad():
-        output = tts_model(**inputs).waveform.squeeze(0)  # Remove batch dimension if present
+def generate_tts_stream(text: str, output_path: str = None) -> Iterator[bytes]:
+    """
+    Synthesise text one sentence at a time, yielding a WAV header followed by the 16-bit PCM audio of each sentence
 
-    # Scale waveform to int16
-    audio_data = (output.numpy() * 32767).astype(np.int16)  # Scale to 16-bit PCM
+    Parameters:
+    - text: The text to synthesise
+    - output_path: If given, the complete audio is also saved here once every sentence has been synthesised
+    """
+    key = generation_cache_key('tts', text, stream_gap=TTS_STREAM_GAP_SECONDS)
+    if output_path and generation_cache.materialise(key, output_path, 'tts'):
+        with open(output_path, 'rb') as file: # A complete WAV file is also a valid stream
+            yield file.read()
+        return
+
+    sentences = split_sentences(text)
+    log_to_console(f"Streaming TTS for {len(sentences)} sentences", tag="GENERATE-TTS-STREAM", spacing=1)
+
+    with model_registry.use('tts') as (tts_model, tokeniser):
+        sampling_rate = tts_model.config.sampling_rate
+        yield create_streaming_wav_header(sampling_rate)
+
+        gap = np.zeros(int(TTS_STREAM_GAP_SECONDS * sampling_rate), dtype=np.int16)
+        chunks = []
+        for sentence in sentences:
+            inputs = tokeniser(sentence, return_tensors="pt")
+            with torch.no_grad():
+                output = tts_model(**inputs).waveform.squeeze(0)
+
+            audio_data = np.concatenate([(output.numpy() * 32767).astype(np.int16), gap])  # Scale to 16-bit PCM
+            chunks.append(audio_data)
+            yield audio_data.astype('<i2').tobytes()
+
+    if output_path and chunks:
+        prepare_output_path(output_path)
+        wav.write(output_path, rate=sampling_rate, data=np.concatenate(chunks))
+        generation_cache.store(key, output_path, 'tts')
+        log_to_console(f"Streamed audio saved to: {output_path}", tag="GENERATE-TTS-STREAM", spacing=1)
+
+def publish_tts_stream(flight: Flight, text: str, output_path: str) -> Union[str, None]:
+    """
+    Run generate_tts_stream for a shared generation, stopping between sentences once every listener has disconnected
 
-    log_to_console(f"Saving audio file to: {output_path}", tag="GENERATE-TTS-FILE", spacing=1)
-    wav.write(output_path, rate=tts_model.config.sampling_rate, data=audio_data)
-    log_to_console(f"Audio file saved successfully", tag="GENERATE-TTS-FILE", spacing=1)
+    Returns:
+    - The path of the complete audio file, or None if the generation was cancelled
+    """
+    stream = generate_tts_stream(text, output_path)
+    try:
+        for chunk in stream:
+            if flight.cancelled.is_set():
+                log_to_console("Every listener disconnected, stopping TTS stream", tag="GENERATE-TTS-STREAM", spacing=1)
+                return None
+            flight.publish(chunk)
+    finally:
+        stream.close()
+    return output_path
+
+def stream_shared_tts(text: str, output_path: str) -> Iterator[bytes]:
+    """
+    Stream TTS audio, sharing the generation with any identical request that is already streaming
+    The complete file is linked to output_path once the stream ends
+    """
+    key = generation_cache_key('tts', text, stream_gap=TTS_STREAM_GAP_SECONDS)
+    with single_flight.attach(key, lambda flight: publish_tts_stream(flight, text, output_path)) as flight:
+        yield from flight.iter_chunks()
+    if flight.result and flight.result != output_path:
+        link_file(flight.result, output_path)
+
+def run_shared_generation(key: str, func: Callable[[str], None], output_path: str) -> None:
+    """
+    Run func(output_path) unless an identical generation is already running, in which case its file is linked to output_path
+    """
+    with single_flight.attach(key, lambda flight: func(output_path) or output_path) as flight:
+        result_path = flight.wait()
+    if result_path != output_path:
+        link_file(result_path, output_path)
 
-def generate_sound_file(model: Literal['audio', 'music'], description: str, output_path: str, duration: int = 5) -> None:
+def generate_sound_file(model: Literal['audio', 'music'], description: str, output_path: str, duration: int = 5, seed: int = 0) -> None:
     """
     Generate an audio file (sound effect or music) from the given description and save it to the output path
+    (audio_write adds .wav to the output path)
     """
 
     if DEBUG:
         raise ValueError("Audio generation is disabled in debug mode") # Safety - See above (DEBUG flag)
 
+    key = generation_cache_key(model, description, duration=duration, seed=seed)
+    if generation_cache.materialise(key, f"{output_path}.wav", model):
+        return
+
+    if model not in ('audio', 'music'):
+        raise ValueError("Invalid model type")
+
+    prepare_output_path(f"{output_path}.wav")
     if model == 'audio':
         log_to_console(f"Generating audio file for description: {description}", tag="GENERATE-AUDIO-FILE", spacing=1)
-        audio_model.set_generation_params(duration=duration)
-        wav = audio_model.generate([description])[0]
-        audio_write(output_path, wav.cpu(), audio_model.sample_rate, strategy="loudness", loudness_compressor=True)
+        with model_registry.use('audio') as audio_model:
+            audio_model.set_generation_params(duration=duration)
+            wav = audio_model.generate([description])[0]
+            audio_write(output_path, wav.cpu(), audio_model.sample_rate, strategy="loudness", loudness_compressor=True)
     elif model == 'music':
         log_to_console(f"Generating music file for description: {description}", tag="GENERATE-MUSIC-FILE", spacing=1)
-        music_model.set_generation_params(duration=duration)
-        wav = music_model.generate([description])[0] # The 0 indexing killed me, I spent an hour trying to figure out why I was getting this error: ValueError: Input wav should be at most 2 dimension. It was cause this mf was returning a list
-        audio_write(output_path, wav.cpu(), music_model.sample_rate, strategy="loudness")
-    else:
-        raise ValueError("Invalid model type")
+        with model_registry.use('music') as music_model:
+            music_model.set_generation_params(duration=duration)
+            wav = music_model.generate([description])[0] # The 0 indexing killed me, I spent an hour trying to figure out why I was getting this error: ValueError: Input wav should be at most 2 dimension. It was cause this mf was returning a list
+            audio_write(output_path, wav.cpu(), music_model.sample_rate, strategy="loudness")
+
+    generation_cache.store(key, f"{output_path}.wav", model)
+    log_to_console("Audio file saved successfully", tag="GENERATE-AUDIO-FILE", spacing=1)
 
-    log_to_console(f"Audio file saved successfully", tag="GENERATE-AUDIO-FILE", spacing=1)
+def generate_sound_batch(descriptions: list[str], output_paths: list[str], duration: int = 5, batch_size: int = AUDIO_BATCH_SIZE, on_saved: Callable[[str], None] = None, seed: int = 0) -> None:
+    """
+    Generate several sound effect files with batched AudioGen calls and save them to the output paths
 
-def generate_image_file(description: str, output_path: str) -> None:
+    The descriptions are split into chunks of at most batch_size so that a single generate call fits in memory
+    on_saved is called with each output path once its file has been written
     """
-    Generate an image file from the given description and save it to the output path
+    if DEBUG:
+        raise ValueError("Audio generation is disabled in debug mode") # Safety - See above (DEBUG flag)
+
+    if len(descriptions) != len(output_paths):
+        raise ValueError("Number of descriptions and output paths must match")
+
+    descriptions, output_paths, keys = materialise_cached('audio', descriptions, output_paths, file_suffix='.wav', on_saved=on_saved, duration=duration, seed=seed)
+    if not descriptions:
+        return
+
+    log_to_console(f"Generating {len(descriptions)} audio files in batches of {batch_size}", tag="GENERATE-AUDIO-BATCH", spacing=1)
+
+    batch_size = max(1, batch_size)
+    for start in range(0, len(descriptions), batch_size):
+        chunk = descriptions[start:start + batch_size]
+        with model_registry.use('audio') as audio_model: # Held per chunk so that chat requests can use the accelerator in between
+            audio_model.set_generation_params(duration=duration)
+            wavs = audio_model.generate(chunk)
+            for offset, wav in enumerate(wavs):
+                output_path = output_paths[start + offset]
+                prepare_output_path(f"{output_path}.wav")
+                audio_write(output_path, wav.cpu(), audio_model.sample_rate, strategy="loudness", loudness_compressor=True)
+                generation_cache.store(keys[start + offset], f"{output_path}.wav", 'audio')
+                log_to_console(f"Saved audio file to: {output_path}", tag="GENERATE-AUDIO-BATCH", spacing=0)
+                if on_saved:
+                    on_saved(output_path)
+
+    log_to_console("Batch audio generation complete", tag="GENERATE-AUDIO-BATCH", spacing=1)
+
+# Style prompts dictionary
+IMAGE_STYLE_PROMPTS = {
+    "realistic": "Realistic, highly detailed, professional photography, 8k, HDR lighting",
+    "artistic": "highly detailed, digital painting, trending on artstation, ethereal lighting, soft focus",
+    "cartoonish": "vibrant cartoon style, bold lines, pastel colors, dynamic composition"
+}
+
+# Generation parameters
+IMAGE_GENERATION_PARAMS = {
+    'num_inference_steps': 1,
+    'guidance_scale': 0.0,
+    'height': 512,
+    'width': 512
+}
+
+def enhance_image_prompt(description: str) -> str:
+    """Add the style prompt to an image description"""
+    # Using hardcoded realistic style for now
+    return f"{description}, {IMAGE_STYLE_PROMPTS['realistic']}"
+
+def create_image_generators(count: int, seed: int) -> list:
+    """Create a seeded random generator for each image in a pipeline call so each image only depends on its prompt and the seed"""
+    return [torch.Generator(device='cuda' if torch.cuda.is_available() else 'cpu').manual_seed(seed) for _ in range(count)]
+
+def generate_image_batch(descriptions: list[str], output_paths: list[str], batch_size: int = IMAGE_BATCH_SIZE, on_saved: Callable[[str], None] = None, seed: int = 0) -> None:
     """
-    log_to_console(f"Generating image file for description: {description}", tag="GENERATE-IMAGE-FILE", spacing=1)
+    Generate several image files with batched pipeline calls and save them to the output paths
 
+    The descriptions are split into chunks of at most batch_size so that a single pipeline call fits in memory
+    on_saved is called with each output path once its file has been written
+    """
     if DEBUG:
         raise ValueError("Image generation is disabled in debug mode")
 
-    try:
-        # Style prompts dictionary
-        style_prompts = {
-            "realistic": "Realistic, highly detailed, professional photography, 8k, HDR lighting",
-            "artistic": "highly detailed, digital painting, trending on artstation, ethereal lighting, soft focus",
-            "cartoonish": "vibrant cartoon style, bold lines, pastel colors, dynamic composition"
-        }
-        # Using hardcoded artistic style for now
-        enhanced_prompt = f"{description}, {style_prompts['realistic']}"
-
-        # Generation parameters
-        params = {
-            'num_inference_steps': 1,
-            'guidance_scale': 0.0,
-            'height': 512,
-            'width': 512
-        }
-        image = image_pipe(enhanced_prompt, **params).images[0]
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        image.save(output_path, format='PNG')
+    if len(descriptions) != len(output_paths):
+        raise ValueError("Number of descriptions and output paths must match")
 
-        log_to_console(f"Image file saved successfully to: {output_path}", tag="GENERATE-IMAGE-FILE", spacing=1)
+    prompts = [enhance_image_prompt(description) for description in descriptions]
+    prompts, output_paths, keys = materialise_cached('image', prompts, output_paths, on_saved=on_saved, seed=seed, **IMAGE_GENERATION_PARAMS)
+    if not prompts:
+        return
+
+    log_to_console(f"Generating {len(prompts)} image files in batches of {batch_size}", tag="GENERATE-IMAGE-BATCH", spacing=1)
+
+    try:
+        batch_size = max(1, batch_size)
+        for start in range(0, len(prompts), batch_size):
+            chunk = prompts[start:start + batch_size]
+            with model_registry.use('image') as image_pipe:
+                images = image_pipe(chunk, generator=create_image_generators(len(chunk), seed), **IMAGE_GENERATION_PARAMS).images
+            for offset, image in enumerate(images):
+                output_path = output_paths[start + offset]
+                prepare_output_path(output_path)
+                image.save(output_path, format='PNG')
+                generation_cache.store(keys[start + offset], output_path, 'image')
+                log_to_console(f"Image file saved successfully to: {output_path}", tag="GENERATE-IMAGE-BATCH", spacing=0)
+                if on_saved:
+                    on_saved(output_path)
 
     except Exception as e:
-        log_to_console(f"Error generating image: {e}", tag="GENERATE-IMAGE-FILE", spacing=1)
+        log_to_console(f"Error generating images: {e}", tag="GENERATE-IMAGE-BATCH", spacing=1)
         raise e
 
+def rejection_response(error: AdmissionError) -> tuple[Response, int, dict]:
+    """Create the 429 response for a request rejected by the scheduler"""
+    return jsonify({'error': str(error), 'retry_after': error.retry_after}), 429, {'Retry-After': str(error.retry_after)}
+
 def validate_request(text: str, username: str, tag: str) -> tuple[bool, Response, int]:
     """
     Validate the request data
@@ -334,18 +1729,18 @@ def validate_request(text: str, username: str, tag: str) -> tuple[bool, Response
     """
     if not text:
         log_to_console("No text provided", tag=tag, spacing=1)
-        return jsonify({'error': 'No text provided'}), 400
+        return False, jsonify({'error': 'No text provided'}), 400
     
     # Check if user is in database
     user = User.query.filter_by(username=username).first()
     if not user:
         log_to_console(f"User '{username}' not found", tag=tag, spacing=1)
-        return jsonify({'error': 'User not found'}), 404
+        return False, jsonify({'error': 'User not found'}), 404
         
     # Check if the request_data['username'] exists
     if not os.path.exists(os.path.join(USERDATA_DIR, username)):
         log_to_console(f"Username '{username}' not found", tag=tag, spacing=1)
-        return jsonify({'error': 'User not found'}), 404
+        return False, jsonify({'error': 'User not found'}), 404
 
     output_path = os.path.join(USERDATA_DIR, username, 'temp')
     # Create temp directory if it doesn't exist
@@ -354,25 +1749,185 @@ def validate_request(text: str, username: str, tag: str) -> tuple[bool, Response
 
     return True, None, 0 # Success
 
-def get_thumbnail(thumbnail_path, debug: bool = False) -> Union[str, None]:
-    """Get the thumbnail for a file if it exist otherwise return None"""
-    log_to_console(f"Checking for thumbnail at path: {thumbnail_path}", tag="THUMBNAIL", spacing=1)
+IMAGE_MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.avif': 'image/avif'
+}
+
+AUDIO_MIME_TYPES = {
+    '.wav': 'audio/wav',
+    '.opus': 'audio/ogg',
+    '.flac': 'audio/flac'
+}
+
+AUDIO_ASSET_TYPES = ['narration', 'sound', 'music', 'soundtrack']
+
+def get_derivative_path(image_path: str, size: int, format: str = 'webp') -> str:
+    """Get the path of a resized copy of an image (the file may not exist)"""
+    directory, file_name = os.path.split(image_path)
+    return os.path.join(directory, 'derivatives', f"{os.path.splitext(file_name)[0]}_{size}.{format}")
+
+def get_image_variant(image_path: str, size: int) -> str:
+    """Get the path of the precomputed WebP copy of an image at the given size, or the original image if there isn't one"""
+    derivative_path = get_derivative_path(image_path, size)
+    if os.path.exists(derivative_path):
+        return derivative_path
+    return image_path
+
+def create_image_derivatives(image_path: str, sizes: list[int], overwrite: bool = True) -> None:
+    """
+    Create WebP (and optionally AVIF) copies of an image at each of the given sizes
 
-    # TODO - Adding todo just so this stands out, this process becomes quite intensive if there are a lot of stories, ideally a set of thumbnails would be pre-computed, it saves a loooooot of computation
+    Parameters:
+    - image_path: The path of the original image
+    - sizes: The sizes (longest side in pixels) to create
+    - overwrite: Recreate derivatives that already exist and are newer than the original image
+    """
+    if not os.path.exists(image_path):
+        return
+
+    # Decoding and resizing is the slow part, so the image is only opened if a derivative is missing or out of date
+    formats = ['webp', 'avif'] if IMAGE_DERIVATIVE_AVIF else ['webp']
+    modified = os.path.getmtime(image_path)
+    stale = {(size, format) for size in sizes for format in formats
+             if overwrite or not os.path.exists(get_derivative_path(image_path, size, format))
+             or os.path.getmtime(get_derivative_path(image_path, size, format)) < modified}
+    if not stale:
+        return
+
+    with Image.open(image_path) as image:
+        image = image.convert('RGB')
+        for size in sizes:
+            if not any((size, format) in stale for format in formats):
+                continue
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS) # Keeps the aspect ratio and never upscales
+            for format in formats:
+                if (size, format) not in stale:
+                    continue
+                derivative_path = get_derivative_path(image_path, size, format)
+
+                os.makedirs(os.path.dirname(derivative_path), exist_ok=True)
+                try:
+                    resized.save(derivative_path, format=format.upper(), quality=IMAGE_DERIVATIVE_QUALITY)
+                except (KeyError, OSError) as e: # Raised if Pillow wasn't built with support for the format
+                    log_to_console(f"Could not save {format} derivative of {image_path}: {e}", tag="IMAGE-DERIVATIVES", spacing=0)
+
+def create_story_derivatives(data_path: str, overwrite: bool = True) -> None:
+    """
+    Create the catalogue thumbnail and the display sizes of every image in a story
+    """
+    for file in os.listdir(data_path):
+        if file == 'thumbnail.png':
+            create_image_derivatives(os.path.join(data_path, file), sorted(set(DISPLAY_IMAGE_SIZES + [CATALOGUE_THUMBNAIL_SIZE])), overwrite)
+        elif file.startswith('image') and file.endswith('.png'):
+            create_image_derivatives(os.path.join(data_path, file), DISPLAY_IMAGE_SIZES, overwrite)
+
+def find_story_image(data_path: str, file_name: str) -> Union[str, None]:
+    """
+    Find an image of a story (original or derivative) by its file name
+
+    Returns:
+    - The path of the image, or None if the story has no image with that name
+    """
+    # Only plain image file names are accepted so that the path can't escape the story directory
+    if file_name != os.path.basename(file_name) or os.path.splitext(file_name)[1].lower() not in IMAGE_MIME_TYPES:
+        return None
+
+    for directory in [data_path, os.path.join(data_path, 'derivatives')]:
+        image_path = os.path.join(directory, file_name)
+        if os.path.isfile(image_path):
+            return image_path
+    return None
+
+def get_manifest_image_url(story_id: int, asset: Union[dict, None], size: int = None) -> str:
+    """
+    Get the URL of a story image from its manifest entry, using the derivative at the given size if there is one
+    The URL includes the version of the image so that it changes whenever the image is regenerated
+    """
+    if not asset:
+        return url_for('static', filename='assets/default_thumbnail.jpg')
+
+    file_name = asset.get('derivatives', {}).get(str(size), asset['file'])
+    return url_for('story_image', storyID=story_id, file_name=file_name, v=asset['version'])
+
+def find_story_thumbnail(data_path: str) -> tuple[Union[str, None], Union[int, None]]:
+    """
+    Find the catalogue thumbnail of a story
+
+    Returns:
+    - The file name of the thumbnail (derivative if there is one), or None if the story has no thumbnail
+    - The modification time of the thumbnail
+    """
+    thumbnail_path = get_image_variant(os.path.join(data_path, 'thumbnail.png'), CATALOGUE_THUMBNAIL_SIZE)
+    if not os.path.exists(thumbnail_path):
+        return None, None
+    return os.path.basename(thumbnail_path), int(os.path.getmtime(thumbnail_path))
+
+def get_story_thumbnail_url(story: dict) -> str:
+    """
+    Get the URL of a story's catalogue thumbnail from its database record (no file system access)
+    """
+    if not story.get('thumbnail'):
+        return url_for('static', filename='assets/default_thumbnail.jpg')
+    return url_for('story_image', storyID=story['id'], file_name=story['thumbnail'], v=story['thumbnail_version'])
+
+def backfill_story_metadata() -> None:
+    """
+    Fill in the paragraph count, thumbnail and creation time of stories committed before they were stored in the database
+    """
+    stories = Story.query.filter(db.or_(Story.paragraph_count.is_(None), Story.created_at.is_(None))).all()
+    if not stories:
+        return
+
+    log_to_console(f"Backfilling metadata for {len(stories)} stories", tag="STORY-METADATA", spacing=1)
+    for story in stories:
+        if not os.path.isdir(story.data_path):
+            continue
+        try:
+            with open(os.path.join(story.data_path, 'paragraphs.json'), 'r') as file:
+                story.paragraph_count = len(json.load(file))
+        except (OSError, ValueError) as e:
+            log_to_console(f"Could not read paragraphs of {story.data_path}: {e}", tag="STORY-METADATA", spacing=0)
+        story.thumbnail, story.thumbnail_version = find_story_thumbnail(story.data_path)
+        if story.created_at is None:
+            story.created_at = os.path.getmtime(story.data_path)
+    db.session.commit()
+
+def backfill_image_derivatives() -> None:
+    """
+    Create any missing image derivatives for the stories in the database
+    """
+    log_to_console("Backfilling image derivatives", tag="IMAGE-DERIVATIVES", spacing=1)
+    for story in Story.query.all():
+        if not os.path.isdir(story.data_path):
+            continue
+        try:
+            create_story_derivatives(story.data_path, overwrite=False)
+        except Exception as e:
+            log_to_console(f"Error creating derivatives for {story.data_path}: {e}", tag="IMAGE-DERIVATIVES", spacing=0)
 
-    if os.path.exists(thumbnail_path):
-        with open(thumbnail_path, 'rb') as thumbnail_file:
-            thumbnail = base64.b64encode(thumbnail_file.read()).decode('utf-8')
-            return thumbnail
-            
-    else:
-        log_to_console(f"Thumbnail not found at path: {thumbnail_path}", tag="THUMBNAIL", spacing=1)
-        thumbnail_path = os.path.join(STATIC_DIR, 'assets', 'default_thumbnail.jpg')
-        return base64.b64encode(open(thumbnail_path, 'rb').read()).decode('utf-8')
-    
 #-----------------------------------------------------Story Generation-----------------------------------------------------#
 
-def generate_story_tts(paragraphs: list[str], data_path: str) -> None:
+def select_story_assets(assets: list[tuple[str, str, str]], skip_assets: set[str] = None) -> tuple[list[str], list[str], dict[str, str]]:
+    """
+    Filter a list of (asset name, prompt, output path) tuples, dropping the assets in skip_assets
+
+    Returns:
+    - The prompts of the remaining assets
+    - The output paths of the remaining assets
+    - A dictionary mapping each remaining output path to its asset name
+    """
+    skip_assets = skip_assets or set()
+    assets = [asset for asset in assets if asset[0] not in skip_assets]
+    for name, _, _ in assets:
+        log_to_console(f"Queued asset: {name}", tag="GENERATE-STORY", spacing=0)
+    return [asset[1] for asset in assets], [asset[2] for asset in assets], {asset[2]: asset[0] for asset in assets}
+
+def generate_story_tts(paragraphs: list[str], data_path: str, skip_assets: set[str] = None, on_asset_saved: Callable[[str], None] = None, seed: int = 0) -> None:
     """
     Generate TTS audio files for the story paragraphs
     The audio files are saved in the given data path and are named paragraph_1.wav, paragraph_2.wav, etc.
@@ -380,12 +1935,17 @@ def generate_story_tts(paragraphs: list[str], data_path: str) -> None:
     Parameters:
     - paragraphs: A list of paragraphs in the story
     - data_path: The path to the directory to save the audio files
+    - skip_assets: Asset names (e.g. paragraph_1) that should not be generated
+    - on_asset_saved: Called with the asset name once each file has been written
+    - seed: Only part of the cache key, a different seed skips the cached files so they are generated again
 
     """
 
     # NOTE: I imagine TTS will always be loaded so nothing extra here
-    for i, paragraph in enumerate(paragraphs, start=1):
-        generate_tts_file(paragraph, os.path.join(data_path, f"paragraph_{i}.wav"))
+    assets = [(f"paragraph_{i}", paragraph, os.path.join(data_path, f"paragraph_{i}.wav")) for i, paragraph in enumerate(paragraphs, start=1)]
+    texts, output_paths, names = select_story_assets(assets, skip_assets)
+    if texts:
+        generate_tts_batch(texts, output_paths, on_saved=(lambda path: on_asset_saved(names[path])) if on_asset_saved else None, seed=seed)
 
 
 def create_story_sequence(story_dict: dict) -> tuple[list[str], list[str], list[str]]:
@@ -417,62 +1977,568 @@ def create_story_sequence(story_dict: dict) -> tuple[list[str], list[str], list[
 
     return story_sequence, audio_prompts, image_prompts
     
-def generate_story_sounds(audio_prompts: list[str], data_path: str) -> None:
+def generate_story_sounds(audio_prompts: list[str], data_path: str, skip_assets: set[str] = None, on_asset_saved: Callable[[str], None] = None, seed: int = 0) -> None:
     """
     Generate sound files for the story based on the given audio prompts
     
     Parameters:
     - audio_prompts: A list of audio prompts
     - data_path: The path to the directory to save the audio files
+    - skip_assets: Asset names (e.g. audio_1) that should not be generated
+    - on_asset_saved: Called with the asset name once each file has been written
+    - seed: Only part of the cache key, a different seed skips the cached files so they are generated again
     """
-    for i, audio_prompt in enumerate(audio_prompts, start=1):
-        generate_sound_file('audio', audio_prompt, os.path.join(data_path, f"audio_{i}.wav"))  # TODO - Variable length sound effects? random perchance
+    assets = [(f"audio_{i}", audio_prompt, os.path.join(data_path, f"audio_{i}.wav")) for i, audio_prompt in enumerate(audio_prompts, start=1)]
+    descriptions, output_paths, names = select_story_assets(assets, skip_assets)
+    if descriptions:
+        generate_sound_batch(descriptions, output_paths, on_saved=(lambda path: on_asset_saved(names[path])) if on_asset_saved else None, seed=seed)  # TODO - Variable length sound effects? random perchance
 
-def generate_story_music(story_dict: dict, data_path: str) -> None:
+def generate_story_music(story_dict: dict, data_path: str, skip_assets: set[str] = None, on_asset_saved: Callable[[str], None] = None, seed: int = 0) -> None:
     """
     Generate the music file for the story based on the given story dictionary
     
     Parameters:
     - story_dict: The dictionary containing the story data
     - data_path: The path to the directory to save the music file
+    - skip_assets: Asset names that should not be generated (music is skipped if it is included)
+    - on_asset_saved: Called with the asset name once the file has been written
+    - seed: Only part of the cache key, a different seed skips the cached file so it is generated again
     """
     music_prompt = story_dict.get('music', None)
     if not music_prompt:
         log_to_console("No music tag found in story dict", tag="GENERATE-STORY", spacing=1)
+    elif skip_assets and 'music' in skip_assets:
+        log_to_console("Skipping music generation", tag="GENERATE-STORY", spacing=1)
+    else:
+        generate_sound_file('music', music_prompt, os.path.join(data_path, 'music'), duration=20, seed=seed) # TODO - Scale duration based on story length?
+        if on_asset_saved:
+            on_asset_saved('music')
+
+
+def generate_story_images(image_prompts: list[str], story_dict: dict, data_path: str, skip_assets: set[str] = None, on_asset_saved: Callable[[str], None] = None, seed: int = 0) -> None:
+    """
+    Generate images for the story based on the given image prompts
+    Also generates a thumbnail for the story
+    
+    Parameters:
+    - image_prompts: A list of image prompts
+    - data_path: The path to the directory to save the images
+    - skip_assets: Asset names (e.g. image_1, thumbnail) that should not be generated
+    - on_asset_saved: Called with the asset name once each file has been written
+    - seed: Seed of the image generators (a different seed generates new images)
+    """
+    assets = [(f"image_{i}", image_prompt, os.path.join(data_path, f"image_{i}.png")) for i, image_prompt in enumerate(image_prompts, start=1)]
+
+    thumbnail_prompt = story_dict.get('thumbnail', None)
+    if not thumbnail_prompt:
+        log_to_console("No thumbnail tag found in story dict", tag="GENERATE-STORY", spacing=1)
     else:
-        generate_sound_file('music', music_prompt, os.path.join(data_path, 'music'), duration=20) # TODO - Scale duration based on story length?
+        assets.append(('thumbnail', thumbnail_prompt, os.path.join(data_path, 'thumbnail.png')))
+
+    descriptions, output_paths, names = select_story_assets(assets, skip_assets)
+    if descriptions:
+        generate_image_batch(descriptions, output_paths, on_saved=(lambda path: on_asset_saved(names[path])) if on_asset_saved else None, seed=seed)
+
+    # Precompute the smaller copies used by the catalogue and story pages
+    for image_path in output_paths:
+        create_story_image_derivatives(image_path, names[image_path])
+
+def create_story_image_derivatives(image_path: str, name: str) -> None:
+    """Create the smaller copies of a story image (the thumbnail also gets a catalogue sized copy)"""
+    sizes = DISPLAY_IMAGE_SIZES + [CATALOGUE_THUMBNAIL_SIZE] if name == 'thumbnail' else DISPLAY_IMAGE_SIZES
+    create_image_derivatives(image_path, sorted(set(sizes)))
+
+def save_paragraphs(paragraphs: list[str], data_path: str) -> None:
+    """
+    Save the paragraphs to a json file in the given data path
+    """
+    paragraphs_path = os.path.join(data_path, 'paragraphs.json')
+    with open(paragraphs_path, 'w') as file:
+        json.dump(paragraphs, file, indent=4)
+
+#-----------------------------------------------------Story Manifest-----------------------------------------------------#
+
+# Everything needed to display and play a story is written to manifest.json when the story is generated so that
+# viewing a story doesn't need to scan the story directory or parse the structure file
+MANIFEST_VERSION = 1
+
+manifest_cache: OrderedDict[int, tuple[float, dict]] = OrderedDict() # Story ID -> (manifest modification time, manifest)
+manifest_cache_lock = threading.Lock()
+
+def find_asset_file(files: list[str], name: str) -> Union[str, None]:
+    """
+    Find the file of an asset (e.g. paragraph_1, music) in a list of file names
+    Sound files can end up with a double extension (audio_write adds .wav to the given path)
+    """
+    for file in sorted(files, key=len):
+        if file.startswith(name + '.'):
+            return file
+    return None
+
+def create_asset_entry(data_path: str, files: list[str], name: str, asset_type: str, prompt: str = None) -> Union[dict, None]:
+    """
+    Create the manifest entry of an asset, or None if the asset's file doesn't exist
+    """
+    file = find_asset_file(files, name)
+    if file is None:
+        return None
+
+    path = os.path.join(data_path, file)
+    asset = {
+        'name': name,
+        'type': asset_type,
+        'file': file,
+        'size': os.path.getsize(path),
+        'version': int(os.path.getmtime(path))
+    }
+    if prompt is not None:
+        asset['prompt'] = prompt
+
+    if asset_type in AUDIO_ASSET_TYPES:
+        try:
+            asset['duration'] = sf.info(path).duration
+        except RuntimeError as e:
+            log_to_console(f"Could not read duration of {path}: {e}", tag="STORY-MANIFEST", spacing=0)
+
+        # Compressed copies created by the audio encoding stage, copies older than the WAV file are of a previous version
+        asset['encodings'] = {}
+        for format in ['opus', 'flac']:
+            encoded_path = get_encoded_audio_path(data_path, name, format)
+            if os.path.exists(encoded_path) and os.path.getmtime(encoded_path) >= os.path.getmtime(path):
+                asset['encodings'][format] = {'file': os.path.relpath(encoded_path, data_path).replace('\\', '/'), 'size': os.path.getsize(encoded_path)}
+                # The version is part of the audio URL so it must change when an encoding is added
+                asset['version'] = max(asset['version'], int(os.path.getmtime(encoded_path)))
+    elif asset_type == 'image':
+        asset['derivatives'] = {}
+        for size in sorted(set(DISPLAY_IMAGE_SIZES + [CATALOGUE_THUMBNAIL_SIZE])):
+            derivative_path = get_derivative_path(path, size)
+            if os.path.exists(derivative_path):
+                asset['derivatives'][str(size)] = os.path.basename(derivative_path)
+
+    return asset
+
+def write_story_manifest(data_path: str, story_dict: dict = None) -> dict:
+    """
+    Write the manifest of a story (paragraphs, prompts and the ordered list of assets with their sizes and durations)
+
+    Returns:
+    - The manifest
+    """
+    if story_dict is None:
+        with open(os.path.join(data_path, 'structure.json'), 'r') as file:
+            story_dict = json.load(file)
+
+    story_sequence, audio_prompts, image_prompts = create_story_sequence(story_dict)
+    files = os.listdir(data_path)
+
+    # Assets are listed in the order they appear in the story
+    assets = []
+    for i, paragraph in enumerate(story_sequence, start=1):
+        assets.append(create_asset_entry(data_path, files, f"paragraph_{i}", 'narration'))
+        assets.append(create_asset_entry(data_path, files, f"audio_{i}", 'sound', audio_prompts[i - 1] if i <= len(audio_prompts) else None))
+        assets.append(create_asset_entry(data_path, files, f"image_{i}", 'image', image_prompts[i - 1] if i <= len(image_prompts) else None))
+    assets.append(create_asset_entry(data_path, files, 'thumbnail', 'image', story_dict.get('thumbnail', None)))
+    assets.append(create_asset_entry(data_path, files, 'music', 'music', story_dict.get('music', None)))
+    assets.append(create_asset_entry(data_path, files, 'soundtrack', 'soundtrack'))
+
+    timeline = None
+    if 'timing.json' in files:
+        with open(os.path.join(data_path, 'timing.json'), 'r') as file:
+            timeline = json.load(file)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'title': story_dict.get('title', 'Untitled Story'),
+        'paragraphs': story_sequence,
+        'prompts': {
+            'thumbnail': story_dict.get('thumbnail', None),
+            'music': story_dict.get('music', None),
+            'images': image_prompts,
+            'audio': audio_prompts
+        },
+        'assets': [asset for asset in assets if asset is not None],
+        'timeline': timeline
+    }
+
+    # Written to a temporary file first so that readers never see a partially written manifest
+    manifest_path = os.path.join(data_path, 'manifest.json')
+    temp_path = f"{manifest_path}.{threading.get_ident()}.tmp" # Unique per thread as the encoding stage may write at the same time
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file, separators=(',', ':'))
+    os.replace(temp_path, manifest_path)
+
+    log_to_console(f"Wrote story manifest: {manifest_path}", tag="STORY-MANIFEST", spacing=0)
+    return manifest
+
+def load_story_manifest(story_id: int, data_path: str) -> dict:
+    """
+    Get the manifest of a story, cached in memory until the manifest file changes
+    Stories generated before manifests existed get one written on first access
+
+    Raises a FileNotFoundError if the story data doesn't exist
+    """
+    manifest_path = os.path.join(data_path, 'manifest.json')
+    try:
+        modified = os.path.getmtime(manifest_path)
+    except FileNotFoundError:
+        write_story_manifest(data_path)
+        modified = os.path.getmtime(manifest_path)
+
+    with manifest_cache_lock:
+        cached = manifest_cache.get(story_id)
+        if cached and cached[0] == modified:
+            manifest_cache.move_to_end(story_id)
+            return cached[1]
+
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+
+    with manifest_cache_lock:
+        manifest_cache[story_id] = (modified, manifest)
+        manifest_cache.move_to_end(story_id)
+        while len(manifest_cache) > MANIFEST_CACHE_SIZE:
+            manifest_cache.popitem(last=False)
+
+    return manifest
+
+#-----------------------------------------------------Story Soundtrack-----------------------------------------------------#
+
+def load_mono_audio(path: str, rate: int) -> np.ndarray:
+    """Load an audio file as a mono float32 array at the given sample rate"""
+    data, file_rate = sf.read(path, dtype='float32', always_2d=True)
+    data = data.mean(axis=1)
+    if file_rate != rate:
+        from scipy.signal import resample_poly
+        divisor = np.gcd(file_rate, rate)
+        data = resample_poly(data, rate // divisor, file_rate // divisor).astype(np.float32)
+    return data
+
+def smooth_envelope(envelope: np.ndarray, width: int) -> np.ndarray:
+    """
+    Moving average of a volume envelope so volume changes ramp over width samples
+    Uses a cumulative sum (linear time) and keeps the length of the envelope, the ends are extended rather than faded to zero
+    """
+    width = max(1, min(width, len(envelope)))
+    padded = np.pad(envelope, (width // 2, width - width // 2 - 1), mode='edge')
+    totals = np.concatenate(([0.0], np.cumsum(padded, dtype=np.float64)))
+    return ((totals[width:] - totals[:-width]) / width).astype(np.float32)
+
+def render_story_soundtrack(data_path: str, paragraph_count: int) -> Union[dict, None]:
+    """
+    Mix the narration and sound effects of a story into soundtrack.wav, one after the other, with the music underneath
+    The music is ducked while the narration plays
+
+    Also writes timing.json with the start and end (in seconds) of every clip so the viewer can highlight the paragraphs
+
+    Returns:
+    - The timing index, or None if the story has no narration
+    """
+    rate = SOUNDTRACK_SAMPLE_RATE
+    files = os.listdir(data_path)
+    gap = np.zeros(int(SOUNDTRACK_GAP_SECONDS * rate), dtype=np.float32)
+
+    clips = []
+    segments = []
+    position = 0
+    for i in range(1, paragraph_count + 1):
+        for name, clip_type in [(f"paragraph_{i}", 'narration'), (f"audio_{i}", 'sound')]:
+            file = find_asset_file(files, name)
+            if file is None:
+                log_to_console(f"Missing {name}, leaving it out of the soundtrack", tag="SOUNDTRACK", spacing=0)
+                continue
+            clip = load_mono_audio(os.path.join(data_path, file), rate)
+            segments.append({'name': name, 'type': clip_type, 'paragraph': i, 'start': position / rate, 'end': (position + len(clip)) / rate})
+            clips.extend([clip, gap])
+            position += len(clip) + len(gap)
+
+    if not any(segment['type'] == 'narration' for segment in segments):
+        log_to_console(f"No narration found, skipping soundtrack: {data_path}", tag="SOUNDTRACK", spacing=1)
+        return None
+
+    mix = np.concatenate(clips)
+
+    music_file = find_asset_file(files, 'music')
+    include_music = SOUNDTRACK_INCLUDE_MUSIC and music_file is not None
+    if include_music:
+        music = load_mono_audio(os.path.join(data_path, music_file), rate)
+        if len(music) == 0:
+            log_to_console(f"Music file is empty, leaving it out of the soundtrack: {music_file}", tag="SOUNDTRACK", spacing=0)
+            include_music = False
+    if include_music:
+        music = np.tile(music, int(np.ceil(len(mix) / len(music))))[:len(mix)] # Loop the music for the length of the story
+
+        # Volume envelope, lower while the narration plays with short ramps so the change isn't abrupt
+        envelope = np.full(len(mix), MUSIC_VOLUME, dtype=np.float32)
+        for segment in segments:
+            if segment['type'] == 'narration':
+                envelope[int(segment['start'] * rate):int(segment['end'] * rate)] = MUSIC_DUCKED_VOLUME
+        envelope = smooth_envelope(envelope, int(0.2 * rate))
+
+        mix = mix + music * envelope
+
+    # Avoid clipping
+    peak = np.abs(mix).max()
+    if peak > 0.99:
+        mix = mix * (0.99 / peak)
+
+    soundtrack_path = os.path.join(data_path, 'soundtrack.wav')
+    sf.write(soundtrack_path + '.tmp', mix, rate, format='WAV', subtype='PCM_16')
+    os.replace(soundtrack_path + '.tmp', soundtrack_path)
+
+    timeline = {
+        'duration': len(mix) / rate,
+        'music': include_music,
+        'segments': segments
+    }
+    with open(os.path.join(data_path, 'timing.json'), 'w') as file:
+        json.dump(timeline, file, separators=(',', ':'))
+
+    log_to_console(f"Rendered soundtrack ({timeline['duration']:.1f}s): {soundtrack_path}", tag="SOUNDTRACK", spacing=1)
+    return timeline
+
+#-----------------------------------------------------Audio Encoding-----------------------------------------------------#
+
+OPUS_SAMPLE_RATES = [8000, 12000, 16000, 24000, 48000] # The only sample rates Opus supports
+SOUNDFILE_COMPRESSION_LEVEL = 'compression_level' in inspect.signature(sf.write).parameters # Added in soundfile 0.12, older versions use the default level
+
+def get_encoded_audio_path(data_path: str, name: str, format: str) -> str:
+    """Get the path of the compressed copy of a story audio asset (the file may not exist)"""
+    return os.path.join(data_path, 'encoded', f"{name}.{format}")
+
+def encode_audio_file(wav_path: str, data_path: str, name: str, formats: list[str], overwrite: bool = False) -> None:
+    """
+    Encode a WAV file to the given formats ('opus' and/or 'flac')
+
+    Parameters:
+    - wav_path: The path of the WAV file
+    - data_path: The story directory
+    - name: The asset name (e.g. paragraph_1), used to name the encoded files
+    - formats: The formats to encode to
+    - overwrite: Re-encode files that already exist and are newer than the WAV file
+    """
+    data, rate = sf.read(wav_path, dtype='float32')
+
+    for format in formats:
+        encoded_path = get_encoded_audio_path(data_path, name, format)
+        if not overwrite and os.path.exists(encoded_path) and os.path.getmtime(encoded_path) >= os.path.getmtime(wav_path):
+            continue
+        os.makedirs(os.path.dirname(encoded_path), exist_ok=True)
+
+        try:
+            if format == 'opus':
+                opus_rate = next((supported for supported in OPUS_SAMPLE_RATES if supported >= rate), OPUS_SAMPLE_RATES[-1])
+                opus_data = data
+                if opus_rate != rate:
+                    from scipy.signal import resample_poly # Only needed for music (32kHz)
+                    divisor = np.gcd(rate, opus_rate)
+                    opus_data = resample_poly(data, opus_rate // divisor, rate // divisor, axis=0).astype(np.float32)
+                options = {'compression_level': OPUS_COMPRESSION_LEVEL} if SOUNDFILE_COMPRESSION_LEVEL else {}
+                sf.write(encoded_path + '.tmp', opus_data, opus_rate, format='OGG', subtype='OPUS', **options)
+            elif format == 'flac':
+                sf.write(encoded_path + '.tmp', data, rate, format='FLAC', subtype='PCM_16')
+            else:
+                raise ValueError(f"Unsupported audio format: {format}")
+            os.replace(encoded_path + '.tmp', encoded_path)
+        except Exception as e: # libsndfile may have been built without Opus support
+            log_to_console(f"Could not encode {wav_path} to {format}: {e}", tag="AUDIO-ENCODING", spacing=0)
+            if os.path.exists(encoded_path + '.tmp'):
+                os.remove(encoded_path + '.tmp')
+
+def encode_story_audio(data_path: str, overwrite: bool = False, names: set[str] = None) -> None:
+    """
+    Encode the narration, sound effects and music of a story and update its manifest
+    Pass names to only encode those assets (e.g. the ones that were regenerated)
+    """
+    log_to_console(f"Encoding audio for story: {data_path}", tag="AUDIO-ENCODING", spacing=1)
+    files = os.listdir(data_path)
+    for file in files:
+        name = file.split('.')[0] # audio_1.wav.wav -> audio_1
+        if not file.endswith('.wav') or not (name.startswith('paragraph_') or name.startswith('audio_') or name in ['music', 'soundtrack']):
+            continue
+        if find_asset_file(files, name) != file: # Skip duplicates, the manifest only uses one file per asset
+            continue
+        if names is not None and name not in names:
+            continue
+        encode_audio_file(os.path.join(data_path, file), data_path, name, AUDIO_ENCODINGS, overwrite)
+
+    write_story_manifest(data_path)
+    log_to_console(f"Finished encoding audio for story: {data_path}", tag="AUDIO-ENCODING", spacing=1)
+
+def queue_audio_encoding(data_path: str, overwrite: bool = False, names: set[str] = None) -> Future:
+    """
+    Encode the audio of a story in the background
+    """
+    def encode() -> None:
+        try:
+            encode_story_audio(data_path, overwrite, names)
+        except Exception as e:
+            log_to_console(f"Error encoding audio for {data_path}: {e}", tag="AUDIO-ENCODING", spacing=1)
+    return PIPELINE_EXECUTORS['encoding'].submit(encode)
+
+def remove_audio_encodings(data_path: str, names: set[str]) -> None:
+    """Delete the compressed copies of the given audio assets so that they aren't served until they have been encoded again"""
+    for name in names:
+        for format in ['opus', 'flac']:
+            encoded_path = get_encoded_audio_path(data_path, name, format)
+            if os.path.exists(encoded_path):
+                os.remove(encoded_path)
+
+def encode_existing_story_audio() -> None:
+    """
+    Migration: queue the audio of every story in the database for encoding (already encoded files are skipped)
+    """
+    stories = Story.query.all()
+    log_to_console(f"Queueing audio encoding for {len(stories)} stories", tag="AUDIO-ENCODING", spacing=1)
+    for story in stories:
+        if os.path.isdir(story.data_path):
+            queue_audio_encoding(story.data_path)
 
+#-----------------------------------------------------Story Pipeline-----------------------------------------------------#
 
-def generate_story_images(image_prompts: list[str], story_dict: dict, data_path: str) -> None:
+# TTS runs on the CPU while the other models share the accelerator, so each resource gets its own worker
+# The accelerator executor has a single worker so that stories from different users queue up instead of fighting over memory
+PIPELINE_EXECUTORS = {
+    'cpu': ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-cpu'),
+    'accelerator': ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-accelerator'),
+    'encoding': ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipeline-encoding') # Audio compression after a story is committed
+}
+
+class StoryTask:
     """
-    Generate images for the story based on the given image prompts
-    Also generates a thumbnail for the story
-    
+    A single asset generation task in the story pipeline
+
     Parameters:
-    - image_prompts: A list of image prompts
-    - data_path: The path to the directory to save the images
+    - name: Unique name of the task within the graph
+    - resource: The executor the task runs on ('cpu' or 'accelerator')
+    - func: The function to run (takes no arguments)
+    - dependencies: Names of the tasks that must finish before this one starts
+    - description: Human readable description used for progress messages
     """
-    for i, image_prompt in enumerate(image_prompts, start=1):
-        generate_image_file(image_prompt, os.path.join(data_path, f"image_{i}.png"))
-
-    thumbnail_prompt = story_dict.get('thumbnail', None)
-    if not thumbnail_prompt:
-        log_to_console("No thumbnail tag found in story dict", tag="GENERATE-STORY", spacing=1)
-    else:
-        generate_image_file(thumbnail_prompt, os.path.join(data_path, 'thumbnail.png'))
+    def __init__(self, name: str, resource: Literal['cpu', 'accelerator'], func: Callable[[], None], dependencies: list[str] = None, description: str = None):
+        self.name = name
+        self.resource = resource
+        self.func = func
+        self.dependencies = dependencies or []
+        self.description = description or name
+
+def run_task_graph(tasks: list[StoryTask], on_complete: Callable[[StoryTask, int, int], None] = None) -> None:
+    """
+    Run a dependency graph of story tasks, starting every task as soon as its dependencies are complete
 
-def save_paragraphs(paragraphs: list[str], data_path: str) -> None:
+    on_complete is called from the calling thread with the finished task, the number of finished tasks and the total
+    Raises the first exception raised by a task (tasks already running are allowed to finish)
     """
-    Save the paragraphs to a json file in the given data path
+    task_map = {task.name: task for task in tasks}
+    for task in tasks:
+        for dependency in task.dependencies:
+            if dependency not in task_map:
+                raise ValueError(f"Task '{task.name}' depends on unknown task '{dependency}'")
+
+    completed = set()
+    pending: dict[Future, StoryTask] = {}
+    submitted = set()
+
+    def submit_ready() -> None:
+        for task in tasks:
+            if task.name in submitted:
+                continue
+            if all(dependency in completed for dependency in task.dependencies):
+                log_to_console(f"Starting task: {task.name} ({task.resource})", tag="STORY-PIPELINE", spacing=0)
+                pending[PIPELINE_EXECUTORS[task.resource].submit(generation_scheduler.bind(task.func))] = task
+                submitted.add(task.name)
+
+    submit_ready()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            task = pending.pop(future)
+            error = future.exception()
+            if error is not None:
+                log_to_console(f"Task {task.name} failed: {error}", tag="STORY-PIPELINE", spacing=1)
+                wait(pending) # Let running tasks finish so they don't write into a story that is being abandoned
+                raise error
+            completed.add(task.name)
+            log_to_console(f"Finished task: {task.name}", tag="STORY-PIPELINE", spacing=0)
+            if on_complete:
+                on_complete(task, len(completed), len(tasks))
+        submit_ready()
+
+    if len(completed) != len(tasks):
+        raise ValueError("Story task graph contains a dependency cycle")
+
+STORY_TASK_ASSET_PREFIXES = { # Assets produced by each task of the story task graph
+    'tts': ('paragraph_',),
+    'sounds': ('audio_',),
+    'images': ('image_', 'thumbnail'),
+    'music': ('music',)
+}
+
+def build_story_task_graph(story_dict: dict, story_sequence: list[str], audio_prompts: list[str], image_prompts: list[str], data_path: str,
+                           skip_assets: set[str] = None, on_asset_saved: Callable[[str], None] = None, seed: int = 0) -> list[StoryTask]:
     """
-    paragraphs_path = os.path.join(data_path, 'paragraphs.json')
-    with open(paragraphs_path, 'w') as file:
-        json.dump(paragraphs, file, indent=4)
+    Build the dependency graph of asset tasks for a story
 
-def regenerate_story(data_path: str) -> None:
+    All asset stages only depend on the story structure, so they are independent of each other
+    skip_assets, on_asset_saved and seed are passed through to the generation functions (used for checkpointing jobs)
+    """
+    return [
+        StoryTask('tts', 'cpu', lambda: generate_story_tts(story_sequence, data_path, skip_assets, on_asset_saved, seed), description="speech"),
+        StoryTask('sounds', 'accelerator', lambda: generate_story_sounds(audio_prompts, data_path, skip_assets, on_asset_saved, seed), description="sound effects"),
+        StoryTask('images', 'accelerator', lambda: generate_story_images(image_prompts, story_dict, data_path, skip_assets, on_asset_saved, seed), description="images"),
+        StoryTask('music', 'accelerator', lambda: generate_story_music(story_dict, data_path, skip_assets, on_asset_saved, seed), description="music"),
+    ]
+
+def get_story_asset_prompts(story_dict: dict) -> dict[str, str]:
+    """Get the text or prompt of every asset of a story by asset name (e.g. paragraph_1, audio_1, image_1, thumbnail, music)"""
+    story_sequence, audio_prompts, image_prompts = create_story_sequence(story_dict)
+    prompts = {f"paragraph_{i}": paragraph for i, paragraph in enumerate(story_sequence, start=1)}
+    prompts.update({f"audio_{i}": audio_prompt for i, audio_prompt in enumerate(audio_prompts, start=1)})
+    prompts.update({f"image_{i}": image_prompt for i, image_prompt in enumerate(image_prompts, start=1)})
+    prompts.update({name: story_dict[name] for name in ('thumbnail', 'music') if story_dict.get(name)})
+    return prompts
+
+def get_story_asset_names(story_dict: dict) -> list[str]:
+    """Get the names of every asset of a story (e.g. paragraph_1, audio_1, image_1, thumbnail, music)"""
+    return list(get_story_asset_prompts(story_dict))
+
+def is_asset_file_valid(path: str) -> bool:
+    """Check that an asset file can be read (a crash during generation can leave empty or truncated files)"""
+    if os.path.getsize(path) == 0:
+        return False
+    try:
+        if path.endswith('.png'):
+            with Image.open(path) as image:
+                image.verify()
+        else:
+            sf.info(path)
+    except Exception:
+        return False
+    return True
+
+def find_broken_assets(story_dict: dict, data_path: str) -> set[str]:
+    """Get the names of the assets of a story whose files are missing or corrupt"""
+    files = os.listdir(data_path)
+    broken = set()
+    for name in get_story_asset_names(story_dict):
+        file = find_asset_file(files, name)
+        if file is None or not is_asset_file_valid(os.path.join(data_path, file)):
+            broken.add(name)
+    return broken
+
+def regenerate_story(data_path: str, target_assets: Union[list[str], str, None] = None, skip_assets: set[str] = None,
+                     on_asset_saved: Callable[[str], None] = None, on_complete: Callable[[StoryTask, int, int], None] = None, seed: int = 0) -> set[str]:
     """
-    Regenerate the story based on the given data path
-    (Currently regenerates the assets, doesn't regenerate the structure)
+    Regenerate the assets of a story based on the given data path
+    (Doesn't regenerate the structure)
+
+    Parameters:
+    - target_assets: Names of the assets to regenerate, 'missing' for the missing and corrupt ones, or None for every asset
+    - skip_assets: Assets that have already been regenerated (used when resuming a job)
+    - on_asset_saved, on_complete: Progress callbacks (see build_story_task_graph and run_task_graph)
+    - seed: Passed to the generation functions, use a new seed to generate the assets again instead of using the cached files
+
+    Returns:
+    - The names of the assets that were regenerated
     """
 
     # Load the story data
@@ -483,12 +2549,404 @@ def regenerate_story(data_path: str) -> None:
     # Create the story sequence
     story_sequence, audio_prompts, image_prompts = create_story_sequence(story_data)
 
-    # TODO - Model loading if implemented and necessary
-    # Generate the story assets
-    generate_story_tts(story_sequence, data_path)
-    generate_story_sounds(audio_prompts, data_path)
-    generate_story_images(image_prompts, story_data, data_path)
-    generate_story_music(story_data, data_path)
+    all_assets = set(get_story_asset_names(story_data))
+    if target_assets == 'missing':
+        targets = find_broken_assets(story_data, data_path)
+    elif target_assets is None:
+        targets = all_assets
+    else:
+        targets = all_assets & set(target_assets)
+    targets -= skip_assets or set()
+    log_to_console(f"Regenerating {len(targets)} assets in {data_path}: {sorted(targets)}", tag="REGENERATE-STORY", spacing=1)
+
+    # Only the task stages that contain a target are run
+    tasks = [task for task in build_story_task_graph(story_data, story_sequence, audio_prompts, image_prompts, data_path,
+                                                     skip_assets=all_assets - targets, on_asset_saved=on_asset_saved, seed=seed)
+             if any(asset.startswith(STORY_TASK_ASSET_PREFIXES[task.name]) for asset in targets)]
+    run_task_graph(tasks, on_complete=on_complete)
+    if any(not asset.startswith(STORY_TASK_ASSET_PREFIXES['images']) for asset in targets): # Images aren't part of the soundtrack
+        render_story_soundtrack(data_path, len(story_sequence))
+    return targets
+
+class StreamingJSONObjectParser:
+    """
+    Incremental parser for a streamed JSON object that reports each top level string field as soon as its value is complete
+
+    Example:
+        parser = StreamingJSONObjectParser()
+        parser.feed('{"title": "The Fo')  # -> []
+        parser.feed('x", "paragraph1"')   # -> [('title', 'The Fox')]
+    Other values (numbers, nested objects) are skipped, parse the full text with json.loads once the stream has ended
+    """
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expecting_key = False
+        self.key = None
+        self.buffer = []
+
+    def feed(self, text: str) -> list[tuple[str, str]]:
+        """Parse the next part of the text and get the fields that were completed"""
+        fields = []
+        for char in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        value = json.loads('"' + ''.join(self.buffer) + '"') # Decodes the escape sequences
+                        if self.expecting_key:
+                            self.key = value
+                        elif self.key is not None:
+                            fields.append((self.key, value))
+                            self.key = None
+                    continue
+                self.buffer.append(char)
+            elif char == '"':
+                self.in_string = True
+                self.buffer = []
+            elif char in '{[':
+                self.depth += 1
+                self.expecting_key = self.depth == 1
+            elif char in '}]':
+                self.depth -= 1
+            elif self.depth == 1 and char == ':':
+                self.expecting_key = False
+            elif self.depth == 1 and char == ',':
+                self.expecting_key = True
+                self.key = None
+        return fields
+
+class EarlyAssetDispatcher:
+    """
+    Starts generating story assets while the story structure is still being generated
+
+    Each field is queued on its stage's executor as soon as it is complete. Fields that arrive while the executor is busy
+    are generated together in one batch. Asset names are given in the order the fields arrive (the same order
+    create_story_sequence uses)
+
+    Parameters:
+    - data_path: The path to the story directory
+    - skip_assets: Asset names that have already been generated (e.g. when resuming a job)
+    """
+    STAGE_RESOURCES = {'tts': 'cpu', 'sounds': 'accelerator', 'images': 'accelerator', 'music': 'accelerator'}
+
+    def __init__(self, data_path: str, skip_assets: set[str] = None):
+        self.data_path = data_path
+        self.skip_assets = skip_assets or set()
+        self.counts = {'paragraph': 0, 'audio': 0, 'image': 0}
+        self.keys = set()
+        self.prompts = {} # Asset name -> prompt the asset was generated from
+        self.saved = set()
+        self.pending = {stage: [] for stage in self.STAGE_RESOURCES} # Stage -> (name, prompt, output path) waiting for the executor
+        self.scheduled = set() # Stages with a batch waiting for the executor
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def get_asset(self, key: str, value: Any) -> Union[tuple[str, str, str], None]:
+        """Get the asset name, stage and output path of a structure field, or None if the field isn't an asset"""
+        if key in self.keys or key == 'title' or not isinstance(value, str) or not value:
+            return None # Repeated keys are left to the final structure
+        self.keys.add(key)
+
+        if key == 'thumbnail':
+            return 'thumbnail', 'images', os.path.join(self.data_path, 'thumbnail.png')
+        if key == 'music':
+            return 'music', 'music', os.path.join(self.data_path, 'music')
+        for prefix, stage, extension in (('paragraph', 'tts', 'wav'), ('image', 'images', 'png'), ('audio', 'sounds', 'wav')):
+            if key.startswith(prefix):
+                self.counts[prefix] += 1
+                name = f"{prefix}_{self.counts[prefix]}"
+                return name, stage, os.path.join(self.data_path, f"{name}.{extension}")
+        return None
+
+    def add_field(self, key: str, value: Any) -> None:
+        """Queue the asset of a completed structure field"""
+        asset = self.get_asset(key, value)
+        if asset is None:
+            return
+        name, stage, output_path = asset
+        self.prompts[name] = value
+        if name in self.skip_assets:
+            return
+
+        log_to_console(f"Dispatching {name} before the structure is complete", tag="GENERATE-STORY", spacing=0)
+        with self.lock:
+            self.pending[stage].append((name, value, output_path))
+            if stage not in self.scheduled:
+                self.scheduled.add(stage)
+                self.futures.append(PIPELINE_EXECUTORS[self.STAGE_RESOURCES[stage]].submit(generation_scheduler.bind(self.generate), stage))
+
+    def generate(self, stage: str) -> None:
+        """Generate every asset queued for a stage (runs on the stage's executor)"""
+        with self.lock:
+            assets = self.pending[stage]
+            self.pending[stage] = []
+            self.scheduled.discard(stage)
+
+        prompts = [asset[1] for asset in assets]
+        output_paths = [asset[2] for asset in assets]
+        names = {asset[2]: asset[0] for asset in assets}
+        on_saved = lambda path: self.saved.add(names[path])
+
+        if stage == 'tts':
+            generate_tts_batch(prompts, output_paths, on_saved=on_saved)
+        elif stage == 'sounds':
+            generate_sound_batch(prompts, output_paths, on_saved=on_saved)
+        elif stage == 'images':
+            generate_image_batch(prompts, output_paths, on_saved=on_saved)
+            for output_path in output_paths:
+                create_story_image_derivatives(output_path, names[output_path])
+        elif stage == 'music':
+            generate_story_music({'music': prompts[0]}, self.data_path, on_asset_saved=self.saved.add)
+
+    def finish(self, story_dict: Union[dict, None], on_asset_saved: Callable[[str], None] = None) -> set[str]:
+        """
+        Wait for the dispatched assets once the structure is complete (or has failed, pass None)
+
+        Returns:
+        - The names of the assets that were generated from the same prompts as the final structure (failed assets and
+          assets whose prompt changed are left for the task graph)
+        """
+        wait(self.futures)
+        for future in self.futures:
+            if future.exception() is not None:
+                log_to_console(f"Early asset generation failed, retrying with the full story: {future.exception()}", tag="GENERATE-STORY", spacing=1)
+        if story_dict is None:
+            return set()
+
+        expected = get_story_asset_prompts(story_dict)
+        generated = {name for name in self.saved if expected.get(name) == self.prompts.get(name)}
+        if on_asset_saved:
+            for name in sorted(generated):
+                on_asset_saved(name)
+        return generated
+
+#-----------------------------------------------------Job Queue-----------------------------------------------------#
+
+# Story generation runs in background workers so that it survives client disconnects and server restarts
+JOB_WORKERS = 1 # Number of jobs processed at once (the pipeline executors are shared, so more workers mainly overlap LLM calls)
+JOB_POLL_INTERVAL = 5 # Seconds between database checks when no job has been signalled
+
+job_available = threading.Event() # Set when a job is queued to wake up the workers
+job_lock = threading.Lock() # Serialises job claims and checkpoints against the SQLite database
+
+def job_room(job_id: int) -> str:
+    """Get the Socket.IO room that receives updates for a job"""
+    return f"job-{job_id}"
+
+def notify_job(job_id: int, event: str, payload: dict) -> None:
+    """
+    Send a Socket.IO event to every client subscribed to the job
+    Progress messages are also stored on the job so that they can be polled
+    """
+    if event == 'story-progress':
+        with job_lock:
+            update_generation_job(job_id, message=payload.get('message'))
+    socketio.emit(event, {**payload, 'job_id': job_id}, to=job_room(job_id))
+
+def checkpoint_job_asset(job_id: int, asset: str) -> None:
+    """
+    Record that an asset of a job has been written to disk (called from the pipeline workers)
+    """
+    with app.app_context(), job_lock:
+        job = db.session.get(GenerationJob, job_id)
+        update_generation_job(job_id, completed_assets=sorted(set(job.completed_assets or []) | {asset}))
+    log_to_console(f"Checkpointed asset {asset} for job {job_id}", tag="JOB-QUEUE", spacing=0)
+
+def admit_story_job(user_id: int, username: str) -> None:
+    """
+    Check that a story or regeneration job can be queued for a user (call with job_lock held, before adding the job)
+    Raises an AdmissionError if the job queue is full, the user already has too many jobs or has used their accelerator quota
+    """
+    active_jobs = GenerationJob.query.filter(GenerationJob.status.in_(['queued', 'running']))
+    queued = active_jobs.count()
+    if queued >= STORY_QUEUE_LIMIT:
+        raise AdmissionError("The story queue is full", generation_scheduler.estimate_wait('story', queued, JOB_WORKERS))
+    if active_jobs.filter(GenerationJob.user_id == user_id).count() >= USER_STORY_LIMIT:
+        raise AdmissionError("You already have stories being generated", generation_scheduler.estimate_wait('story', queued, JOB_WORKERS))
+    generation_scheduler.check_quota(username)
+
+def claim_next_job() -> Union[int, None]:
+    """
+    Mark the oldest queued job as running
+
+    Returns:
+    - The ID of the claimed job, or None if there are no queued jobs
+    """
+    with job_lock:
+        job = GenerationJob.query.filter_by(status='queued').order_by(GenerationJob.id).first()
+        if not job:
+            return None
+        update_generation_job(job.id, status='running')
+        return job.id
+
+def run_story_job(job_id: int) -> None:
+    """
+    Generate the story for a job, skipping any assets that were checkpointed by a previous run
+    """
+    job = db.session.get(GenerationJob, job_id)
+    data_path = job.data_path
+    user_id = job.user_id
+    os.makedirs(data_path, exist_ok=True)
+
+    # Only trust checkpointed assets whose files still exist
+    skip_assets = {asset for asset in (job.completed_assets or []) if any(f.startswith(asset + '.') for f in os.listdir(data_path))}
+    if skip_assets:
+        log_to_console(f"Resuming job {job_id}, skipping {len(skip_assets)} assets", tag="JOB-QUEUE", spacing=1)
+
+    structure_path = os.path.join(data_path, 'structure.json')
+    if os.path.exists(structure_path):
+        with open(structure_path, 'r') as file:
+            story_dict = json.load(file)
+    else:
+        notify_job(job_id, 'story-progress', {'message': 'Generating story structure...'})
+        # Assets are generated while the rest of the structure is still being written
+        dispatcher = EarlyAssetDispatcher(data_path, skip_assets)
+        try:
+            story_dict = create_story_structure(job.story_content, data_path, on_field=dispatcher.add_field)
+        except Exception:
+            dispatcher.finish(None) # Don't leave tasks writing into a failed story
+            raise
+        skip_assets |= dispatcher.finish(story_dict, on_asset_saved=lambda asset: checkpoint_job_asset(job_id, asset))
+    title = story_dict.get('title', 'Untitled Story')
+
+    notify_job(job_id, 'story-progress', {'message': "Creating story sequence..."})
+    story_sequence, audio_prompts, image_prompts = create_story_sequence(story_dict)
+
+    # Generate speech, sound effects, music and images concurrently (TTS on the CPU, the rest on the accelerator)
+    notify_job(job_id, 'story-progress', {'message': "Generating speech, sound effects, music and images..."})
+
+    def report_progress(task: StoryTask, completed: int, total: int) -> None:
+        notify_job(job_id, 'story-progress', {'message': f"Finished generating {task.description} ({completed}/{total})"})
+
+    tasks = build_story_task_graph(story_dict, story_sequence, audio_prompts, image_prompts, data_path,
+                                   skip_assets=skip_assets, on_asset_saved=lambda asset: checkpoint_job_asset(job_id, asset))
+    run_task_graph(tasks, on_complete=report_progress)
+
+    notify_job(job_id, 'story-progress', {'message': "Committing story data..."})
+    save_paragraphs(story_sequence, data_path)
+    render_story_soundtrack(data_path, len(story_sequence))
+    write_story_manifest(data_path, story_dict)
+
+    # A previous run may have crashed after committing the story
+    story = Story.query.filter_by(data_path=data_path).first()
+    story_num = story.id if story else add_story_to_db(title=title, data_path=data_path, isPublic=False, user_id=user_id, paragraph_count=len(story_sequence))
+
+    with job_lock:
+        update_generation_job(job_id, status='complete', story_id=story_num, message='Story generated successfully!')
+    queue_audio_encoding(data_path)
+    notify_job(job_id, 'story-complete', {'message': 'Story generated successfully!', 'title': title, 'url': f'/story-{story_num}'})
+
+def run_regeneration_job(job_id: int) -> None:
+    """
+    Regenerate the target assets of a story, skipping any assets that were regenerated by a previous run of the job
+    """
+    job = db.session.get(GenerationJob, job_id)
+    data_path = job.data_path
+    story_id = job.story_id
+    skip_assets = set(job.completed_assets or [])
+
+    notify_job(job_id, 'story-progress', {'message': "Regenerating story assets..."})
+
+    def report_progress(task: StoryTask, completed: int, total: int) -> None:
+        notify_job(job_id, 'story-progress', {'message': f"Finished regenerating {task.description} ({completed}/{total})"})
+
+    def report_asset(asset: str) -> None:
+        checkpoint_job_asset(job_id, asset)
+        notify_job(job_id, 'story-asset', {'asset': asset})
+
+    # The job ID is used as the seed so that the assets are generated again rather than linked from the cache
+    regenerated = regenerate_story(data_path, job.target_assets, skip_assets=skip_assets, on_asset_saved=report_asset,
+                                   on_complete=report_progress, seed=job_id)
+
+    # The old encodings are removed first so the manifest falls back to the new WAV files until they are encoded again
+    reencode = {asset for asset in regenerated | skip_assets if not asset.startswith(STORY_TASK_ASSET_PREFIXES['images'])}
+    if reencode:
+        reencode.add('soundtrack') # Re-rendered by regenerate_story
+    remove_audio_encodings(data_path, reencode)
+
+    notify_job(job_id, 'story-progress', {'message': "Committing story data..."})
+    write_story_manifest(data_path)
+    update_story_metadata(story_id)
+
+    message = f"Regenerated {len(regenerated | skip_assets)} assets" if regenerated or skip_assets else "No assets needed regenerating"
+    with job_lock:
+        update_generation_job(job_id, status='complete', message=message)
+    if reencode:
+        queue_audio_encoding(data_path, names=reencode)
+    notify_job(job_id, 'story-complete', {'message': message, 'url': f'/story-{story_id}'})
+
+def process_job(job_id: int) -> None:
+    """
+    Run a claimed job and record whether it completed or failed
+    """
+    log_to_console(f"Starting job {job_id}", tag="JOB-QUEUE", spacing=1)
+    start = time.time()
+    try:
+        job = db.session.get(GenerationJob, job_id)
+        username = db.session.get(User, job.user_id).username
+        # Story assets are background work, chat requests use the accelerator first
+        with generation_scheduler.context([username], 'background'):
+            if job.kind == 'regenerate':
+                run_regeneration_job(job_id)
+            else:
+                run_story_job(job_id)
+        generation_scheduler.record('story', time.time() - start)
+        log_to_console(f"Job {job_id} complete", tag="JOB-QUEUE", spacing=1)
+    except Exception as e:
+        log_to_console(f"Job {job_id} failed: {e}", tag="JOB-QUEUE", spacing=1)
+        db.session.rollback()
+        with job_lock:
+            update_generation_job(job_id, status='failed', error=str(e), message='Story generation failed')
+        notify_job(job_id, 'story-error', {'error': str(e)})
+
+def job_worker() -> None:
+    """
+    Background worker that processes queued generation jobs until the server stops
+    Database errors (e.g. "database is locked") are logged and the worker carries on with the next iteration
+    """
+    with app.app_context():
+        while True:
+            try:
+                job_id = claim_next_job()
+                if job_id is None:
+                    job_available.wait(timeout=JOB_POLL_INTERVAL)
+                    job_available.clear()
+                    continue
+                process_job(job_id)
+            except Exception as e:
+                log_to_console(f"Job worker error: {e}", tag="JOB-QUEUE", spacing=1)
+                db.session.rollback()
+                time.sleep(JOB_POLL_INTERVAL) # Give the database time to recover before trying again
+            finally:
+                db.session.remove()
+
+def recover_jobs() -> None:
+    """
+    Requeue jobs that were running when the server stopped so that they resume from their checkpoints
+    """
+    with app.app_context():
+        jobs = GenerationJob.query.filter_by(status='running').all()
+        for job in jobs:
+            job.status = 'queued'
+            job.message = 'Resuming story generation...'
+            log_to_console(f"Requeued interrupted job {job.id} ({job.data_path})", tag="JOB-QUEUE", spacing=0)
+        db.session.commit()
+
+def start_job_workers() -> None:
+    """
+    Start the background job workers
+    """
+    recover_jobs()
+    for i in range(JOB_WORKERS):
+        threading.Thread(target=job_worker, name=f"job-worker-{i}", daemon=True).start()
+    log_to_console(f"Started {JOB_WORKERS} job worker(s)", tag="JOB-QUEUE", spacing=1)
+    job_available.set() # Pick up any recovered jobs immediately
 
 #-----------------------------------------------------Routes-----------------------------------------------------#
 
@@ -503,50 +2961,23 @@ def index():
 @app.route('/stories-<username>')
 def user_stories(username):
 
-    userData = os.path.join(USERDATA_DIR, username)
-
     if username is None:
         return render_template('content_not_found.html', error="No user provided"), 404
-    elif not User.query.filter_by(username=username).first():
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
         return render_template('content_not_found.html', error="User not found"), 404
-    elif not os.path.exists(userData):
-        return render_template('content_not_found.html', error="User data not found"), 404
     elif username != session.get('username', None): # I'm not sure this is the best way to check if the user is logged in
         return render_template('forbidden_access.html', error="You do not have permission to access this page"), 403
     
-    # Get the stories for the user
-    stories = os.listdir(os.path.join(userData, 'stories'))
-
+    # Get the stories for the user (everything the page needs is stored in the database)
     story_data = []
-    try:
-        for story in stories:
-            log_to_console(f"Checking story: {story}", tag="USER-STORIES", spacing=1)
-            # If directory empty skip
-            if not os.listdir(os.path.join(userData, 'stories', story)):
-                log_to_console(f"Story directory is empty: {story}", tag="USER-STORIES", spacing=1)
-                continue
-
-            thumbnail = os.path.join(userData, 'stories', story, 'thumbnail.png')
-            thumbnail = get_thumbnail(thumbnail)
-            # Get story title from structure file
-            with open(os.path.join(userData, 'stories', story, 'structure.json'), 'r') as file:
-                title = json.load(file)['title']
-
-            userID = User.query.filter_by(username=username).first().id
-            storyID = get_story_id(title, userID)
-            if storyID is None:
-                log_to_console(f"Story ID not found for story: {story} by user: {username} (id:{userID})", tag="USER-STORIES", spacing=1)
-                continue
-
-            url = '/story-' + str(storyID)
-
-            story_data.append({
-                'thumbnail': thumbnail,
-                'title': title,
-                'url': url
-            })
-    except Exception as e:
-        return render_template('content_not_found.html', error=str(e)), 404
+    for story in get_user_stories(user.id):
+        story_data.append({
+            'thumbnail': get_story_thumbnail_url(story),
+            'title': story['title'],
+            'url': '/story-' + str(story['id'])
+        })
 
     """
     TODO - consider setting this up in a way where if the user accessing this page is the same as the user in the URL
@@ -556,20 +2987,15 @@ def user_stories(username):
     """
     return render_template('story_catalogue.html', username=username, stories=story_data, pageTitle="Your Stories")
 
-@app.route('/public_stories')
-def public_stories():
-
-    stories = get_all_stories()
+def get_story_previews(stories: list[dict]) -> list[dict]:
+    """
+    Get the data shown for each story on the public catalogue
+    """
     story_data = []
     for story in stories:
-        if not story['isPublic']:
-            continue
-
-        thumbnail = os.path.join(story['data_path'], 'thumbnail.png')
+        storyId = story['id']
 
-        thumbnail = get_thumbnail(thumbnail)
-
-        storyId = get_story_id(story['title'], User.query.filter_by(username=story['username']).first().id)
+        thumbnail = get_story_thumbnail_url(story)
 
         story_data.append({
             'thumbnail': thumbnail,
@@ -577,8 +3003,16 @@ def public_stories():
             'url': '/story-' + str(storyId),
             'author': story['username']
         })
+    return story_data
+
+@app.route('/public_stories')
+def public_stories():
+
+    # Only the first page is rendered, the rest is loaded from /public-stories-page as the user scrolls
+    stories, next_cursor = get_public_stories_page(limit=CATALOGUE_PAGE_SIZE)
+    story_data = get_story_previews(stories)
     
-    return render_template('story_catalogue.html', stories=story_data, pageTitle="Public Stories")
+    return render_template('story_catalogue.html', stories=story_data, pageTitle="Public Stories", nextCursor=next_cursor)
 
 
 @app.route('/story-<storyID>')
@@ -600,37 +3034,19 @@ def story(storyID):
     processed_story_data = {}
     # Try access story data
     try:
-        if not os.path.exists(story_data['data_path']):
-            raise FileNotFoundError("Story data not found")
-        # Remove the first part of data path
-        processed_story_data['safe_path'] = story_data['data_path'].replace(USERDATA_DIR, '')[1:] # Remove the first character which is a slash
-        # Change the data path so that it could be embedded in the page without creating errors due to \
-        processed_story_data['safe_path'] = processed_story_data['safe_path'].replace('\\', '/') # NOTE: The reason we want story is data is so we can access the audio files
-
         processed_story_data['title'] = story_data['title']
         processed_story_data['author'] = story_data['username']
         processed_story_data['isPublic'] = story_data['isPublic']
         processed_story_data['ID'] = storyID
 
-        # Load paragraphs
-        paragraphs_path = os.path.join(story_data['data_path'], 'paragraphs.json')
-        with open(paragraphs_path, 'r') as file:
-            paragraphs = json.load(file)
-
-        # Get images
-        image_names = [f for f in os.listdir(story_data['data_path']) if f.startswith('image')]
-
-        # Get sound prompts from structure file
-        with open(os.path.join(data_path, 'structure.json'), 'r') as file:
-            story_dict = json.load(file)
-
-        # Create the story sequence
-        _, audio_prompts, _ = create_story_sequence(story_dict)
-
+        # Everything needed to display the story is in its manifest
+        manifest = load_story_manifest(storyID, data_path)
+        assets = {asset['name']: asset for asset in manifest['assets']}
+        audio_prompts = manifest['prompts']['audio']
 
         contentBlocks = []
 
-        for i, paragraph in enumerate(paragraphs, start=0):
+        for i, paragraph in enumerate(manifest['paragraphs'], start=0):
             contentBlocks.append({
                 'type': 'text',
                 'text': paragraph,
@@ -638,32 +3054,239 @@ def story(storyID):
 
             contentBlocks.append({
                 'type': 'sound',
-                'text': audio_prompts[i],
+                'text': audio_prompts[i] if i < len(audio_prompts) else '',
             })
 
-            try:
-                contentBlocks.append({
-                    'type': 'image',
-                    'image': get_thumbnail(os.path.join(story_data['data_path'], image_names[i])) # I named this function badly, it's not just for thumbnails
-                })
-            except Exception as e:
-                log_to_console(f"Error loading image: {e}", tag="STORY", spacing=1)
-                contentBlocks.append({
-                    'type': 'image',
-                    'image': get_thumbnail(os.path.join(story_data['data_path'], 'thumbnail.jpg'))
-                })
-
+            # Fall back to the thumbnail if the paragraph has no image
+            image = assets.get(f"image_{i + 1}", assets.get('thumbnail', None))
+            if image is None:
+                log_to_console(f"No image found for paragraph {i + 1}", tag="STORY", spacing=1)
+            contentBlocks.append({
+                'type': 'image',
+                'image': get_manifest_image_url(storyID, image, DISPLAY_IMAGE_SIZES[0])
+            })
 
         processed_story_data['content'] = contentBlocks
 
+        processed_story_data['timeline'] = manifest.get('timeline', None)
+
+        # URLs of the narration, sound effects, music and soundtrack used by the story viewer
+        processed_story_data['audio'] = {
+            asset['name']: url_for('story_audio', storyID=storyID, asset_name=asset['name'], v=asset['version'])
+            for asset in manifest['assets'] if asset['type'] in AUDIO_ASSET_TYPES
+        }
+
     except FileNotFoundError:
         return render_template('content_not_found.html', error="Story data not found"), 404
         
     return render_template('story.html', story=processed_story_data, isOwner=isOwner)
 
 
+@app.route('/public-stories-page', methods=['GET'])
+def public_stories_page():
+    try:
+        cursor = request.args.get('cursor', None)
+        cursor = int(cursor) if cursor else None
+        limit = min(max(1, int(request.args.get('limit', CATALOGUE_PAGE_SIZE))), 100)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+
+    stories, next_cursor = get_public_stories_page(before_id=cursor, limit=limit)
+    return jsonify({'stories': get_story_previews(stories), 'next_cursor': next_cursor}), 200
+
+def select_audio_file(asset: dict) -> str:
+    """
+    Choose which file of an audio asset to send
+    The format query parameter takes priority, otherwise the Accept header is used, falling back to the WAV file
+    """
+    encodings = asset.get('encodings', {})
+    requested = request.args.get('format', None)
+    if requested in encodings:
+        return encodings[requested]['file']
+    if requested == 'wav':
+        return asset['file']
+
+    # Only use a compressed format if the client explicitly accepts it (audio/* and */* don't count)
+    for format, mime_types in [('opus', ['audio/ogg', 'audio/opus']), ('flac', ['audio/flac'])]:
+        if format in encodings and any(mime_type in request.accept_mimetypes.values() for mime_type in mime_types):
+            return encodings[format]['file']
+    return asset['file']
+
+def story_asset_cache_control(isPublic: bool) -> str:
+    """
+    Get the Cache-Control header of a story image or audio file
+    Copies are revalidated (ETag) on every use so that making a story private takes effect straight away,
+    private stories are only kept by the owner's browser (not shared caches)
+    """
+    return 'public, no-cache' if isPublic else 'private, no-cache'
+
+@app.route('/story-audio/<int:storyID>/<asset_name>', methods=['GET'])
+def story_audio(storyID, asset_name):
+    try:
+        story_data = get_story_data(storyID)
+    except ValueError:
+        abort(404)
+
+    isPublic = story_data['isPublic']
+    if not isPublic and session.get('username', None) != story_data['username']:
+        abort(403)
+
+    # The manifest maps the asset name straight to its file
+    try:
+        manifest = load_story_manifest(storyID, story_data['data_path'])
+    except FileNotFoundError:
+        abort(404)
+    asset = next((asset for asset in manifest['assets'] if asset['name'] == asset_name and asset['type'] in AUDIO_ASSET_TYPES), None)
+    if asset is None:
+        abort(404)
+
+    audio_path = os.path.join(story_data['data_path'], select_audio_file(asset))
+    if not os.path.isfile(audio_path):
+        abort(404)
+
+    # conditional=True also handles Range requests (206 Partial Content) so the browser can stream and seek
+    response = send_file(audio_path, mimetype=AUDIO_MIME_TYPES.get(os.path.splitext(audio_path)[1].lower(), 'application/octet-stream'),
+                         conditional=True, etag=True, last_modified=os.path.getmtime(audio_path))
+    response.headers['Cache-Control'] = story_asset_cache_control(isPublic)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Vary'] = 'Accept'
+    return response
+
+@app.route('/story-image/<int:storyID>/<file_name>')
+def story_image(storyID, file_name):
+    try:
+        story_data = get_story_data(storyID)
+    except ValueError:
+        abort(404)
+
+    isPublic = story_data['isPublic']
+    if not isPublic and session.get('username', None) != story_data['username']:
+        abort(403)
+
+    image_path = find_story_image(story_data['data_path'], file_name)
+    if image_path is None:
+        abort(404)
+
+    # Handles If-None-Match / If-Modified-Since and responds with 304 when the browser's copy is still valid
+    response = send_file(image_path, mimetype=IMAGE_MIME_TYPES[os.path.splitext(image_path)[1].lower()], conditional=True, etag=True,
+                         last_modified=os.path.getmtime(image_path))
+    response.headers['Cache-Control'] = story_asset_cache_control(isPublic)
+    return response
+
 #--------------------------------------API--------------------------------------#
 
+STORY_SYSTEM_PROMPT = "You are a storytelling assistant, based on the given prompt generate a story with a title, introduction, body and conclusion and nothing else. Make sure the story is as detailed and interesting as possible.\n"
+
+def create_story_completion(user_prompt: str, stream: bool = False) -> Any:
+    """Request a story from the chat model (returns an iterator of chunks if stream is True)"""
+    return client.chat.completions.create(
+        model="llama-3.3-70b-specdec",
+        messages=[
+            {
+                "role": "system",
+                "content": STORY_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": user_prompt
+            },
+        ],
+        temperature=1,
+        max_tokens=2048,
+        top_p=1,
+        stream=stream
+    )
+
+prompt_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='prompt') # Speculative story completions
+guard_cache: OrderedDict[str, tuple[float, bool]] = OrderedDict() # Normalised prompt -> (time of the verdict, safe)
+guard_cache_lock = threading.Lock()
+
+def normalise_prompt(user_prompt: str) -> str:
+    """Normalise a prompt for the safety verdict cache (case and whitespace don't change the verdict)"""
+    return ' '.join(user_prompt.lower().split())
+
+def get_cached_guard_verdict(user_prompt: str) -> Union[bool, None]:
+    """Get the cached safety verdict of a prompt, or None if it hasn't been checked recently"""
+    key = normalise_prompt(user_prompt)
+    with guard_cache_lock:
+        cached = guard_cache.get(key)
+        if cached is None:
+            return None
+        if time.time() - cached[0] > GUARD_CACHE_TTL:
+            del guard_cache[key]
+            return None
+        guard_cache.move_to_end(key)
+        return cached[1]
+
+def check_prompt_safety(user_prompt: str) -> bool:
+    """
+    Check a prompt with the safety model, reusing recent verdicts for the same prompt
+    Raises any error from the safety model (errors are not cached)
+    """
+    verdict = get_cached_guard_verdict(user_prompt)
+    if verdict is not None:
+        log_to_console(f"Using cached safety verdict ({'safe' if verdict else 'not safe'})", tag="PROMPT", spacing=0)
+        return verdict
+
+    guard = client.chat.completions.create(
+        model="llama-guard-3-8b",
+        messages =[{"role": "user",
+                    "content": user_prompt}],
+        temperature=0.0,
+        max_tokens=1,
+        top_p=1
+    )
+    verdict = guard.choices[0].message.content.strip().lower() == "safe"
+
+    with guard_cache_lock:
+        guard_cache[normalise_prompt(user_prompt)] = (time.time(), verdict)
+        guard_cache.move_to_end(normalise_prompt(user_prompt))
+        while len(guard_cache) > GUARD_CACHE_SIZE:
+            guard_cache.popitem(last=False)
+    return verdict
+
+def discard_completion(completion_future: Union[Future, None]) -> None:
+    """Cancel a speculative completion, or close its stream once it has been opened"""
+    if completion_future is None or completion_future.cancel():
+        return
+
+    def close(future: Future) -> None:
+        if future.exception() is None and hasattr(future.result(), 'close'):
+            future.result().close()
+    completion_future.add_done_callback(close)
+
+def format_sse(data: dict, event: str = None) -> str:
+    """Format a server-sent event"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+def stream_story_reply(user_prompt: str, completion_future: Future = None) -> Iterator[str]:
+    """
+    Relay the tokens of a story completion as server-sent events
+    Each token is sent as a message, the assembled reply is sent in a final 'done' event (or the error in an 'error' event)
+    completion_future can be a stream that was opened speculatively, otherwise a new one is requested
+    """
+    if DEBUG:
+        yield format_sse({'reply': "This is a test reply"}, event='done')
+        return
+
+    reply = []
+    try:
+        completion = completion_future.result() if completion_future else create_story_completion(user_prompt, stream=True)
+        for chunk in completion:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                reply.append(token)
+                yield format_sse({'token': token})
+    except Exception as e:
+        log_to_console(f"Error streaming reply: {e}", tag="PROMPT", spacing=1)
+        yield format_sse({'error': str(e)}, event='error')
+        return
+
+    reply = ''.join(reply)
+    log_to_console(f"Reply: {reply}", tag="PROMPT", spacing=1)
+    yield format_sse({'reply': reply}, event='done')
+
 @app.route('/prompt', methods=['POST'])
 def prompt():
     data = request.json
@@ -674,24 +3297,29 @@ def prompt():
     if user_prompt == "error":
             raise Exception("Why would you want to see an error?")
     
-    try:
-        guard = client.chat.completions.create(
-            model="llama-guard-3-8b",
-            messages =[{"role": "user",
-                        "content": user_prompt}],
-            temperature=0.0,
-            max_tokens=1,
-            top_p=1
-        )
+    stream = data.get('stream', False)
 
-        if guard.choices[0].message.content.strip().lower() == "safe":
+    # Start the completion while the safety check runs (not needed if the verdict is cached), it is discarded if the prompt is unsafe
+    completion_future = None
+    if SPECULATIVE_COMPLETION and not DEBUG and get_cached_guard_verdict(user_prompt) is None:
+        completion_future = prompt_executor.submit(create_story_completion, user_prompt, stream)
+
+    try:
+        if check_prompt_safety(user_prompt):
             log_to_console("Prompt is safe", tag="PROMPT", spacing=1)
         else:
             log_to_console("Prompt not safe", tag="PROMPT", spacing=1)
+            discard_completion(completion_future)
             return jsonify({'error': 'Prompt not safe'})
-    except Exception as e:
+    except Exception:
+        discard_completion(completion_future)
         return jsonify({'error': 'Prompt not safe'})
 
+    if stream:
+        # Tokens are sent as they are generated so the client can show the reply while it is being written
+        return Response(stream_with_context(stream_story_reply(user_prompt, completion_future)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     if DEBUG:
         return jsonify({
             'success': True,
@@ -699,22 +3327,7 @@ def prompt():
         })
     
     try:
-        completion = client.chat.completions.create(
-        model="llama-3.3-70b-specdec",
-        messages=[
-            {
-            "role": "system",
-            "content": "You are a storytelling assistant, based on the given prompt generate a story with a title, introduction, body and conclusion and nothing else. Make sure the story is as detailed and interesting as possible.\n"
-            },
-            {
-                "role": "user",
-                "content": user_prompt
-            },
-        ],
-        temperature=1,
-        max_tokens=2048,
-        top_p=1
-        )
+        completion = completion_future.result() if completion_future else create_story_completion(user_prompt)
 
         reply = completion.choices[0].message.content
 
@@ -742,7 +3355,8 @@ def tts_request():
             'text': request.json.get('text', ''),
             'username': request.json.get('username', ''),
             'index': request.json.get('index', ''),
-            'alreadyGenerated': request.json.get('alreadyGenerated', False)
+            'alreadyGenerated': request.json.get('alreadyGenerated', False),
+            'stream': request.json.get('stream', False)
         }
 
         log_to_console(f"Received request to generate tts: {request_data}", tag="GENERATE-TTS", spacing=1)
@@ -759,7 +3373,22 @@ def tts_request():
             log_to_console(f"Audio file for message {request_data['index']} already exists", tag="GENERATE-TTS", spacing=1)
             return send_file(output_path, mimetype='audio/wav')
 
-        generate_tts_file(request_data['text'], output_path)
+        if request_data['stream']:
+            # Each sentence is sent as soon as it has been synthesised, the full file is saved for replays
+            # The ticket is released when the response is closed, which also happens if the stream is never iterated
+            ticket = generation_scheduler.admit('tts', request_data['username'])
+            try:
+                response = Response(stream_with_context(stream_shared_tts(request_data['text'], output_path)), mimetype='audio/wav')
+            except Exception:
+                generation_scheduler.release(ticket)
+                raise
+            response.call_on_close(lambda: generation_scheduler.release(ticket))
+            return response
+
+        # Identical requests share one generation, different requests that arrive together share one forward pass
+        with generation_scheduler.admission('tts', request_data['username']):
+            run_shared_generation(generation_cache_key('tts', request_data['text']),
+                                  lambda path: tts_batcher.submit((request_data['text'], path)).result(), output_path)
 
         # Enable debug mode (Re-enabling might introduce the same issues but it seemed to work)
         if DEBUG:
@@ -767,6 +3396,8 @@ def tts_request():
 
         # Return the audio file to the client
         return send_file(output_path, mimetype='audio/wav')
+    except AdmissionError as e:
+        return rejection_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -790,8 +3421,8 @@ def sound_effect_request():
         if not validate_success:
             return response, status_code
         
-        output_path = os.path.join(USERDATA_DIR, request_data['username'], 'temp')
-        output_path = os.path.join(output_path, f"{request_data['index']}_se.wav")
+        output_stem = os.path.join(USERDATA_DIR, request_data['username'], 'temp', f"{request_data['index']}_se")
+        output_path = f"{output_stem}.wav" # audio_write adds the extension to the path it is given
 
         # Check if the audio file already exists
         if os.path.exists(output_path):
@@ -799,7 +3430,9 @@ def sound_effect_request():
             return send_file(output_path, mimetype='audio/wav')
 
         descriptions = request_data['text']
-        generate_sound_file('audio', descriptions, output_path, duration=5)
+        with generation_scheduler.admission('audio', request_data['username'], uses_accelerator=True), generation_scheduler.context([request_data['username']]):
+            run_shared_generation(generation_cache_key('audio', descriptions, duration=5),
+                                  generation_scheduler.bind(lambda path: generate_sound_file('audio', descriptions, os.path.splitext(path)[0], duration=5)), output_path)
 
         # Enable debug mode (Re-enabling might introduce the same issues but it seemed to work)
         if DEBUG:
@@ -807,6 +3440,8 @@ def sound_effect_request():
 
         # Return
         return send_file(output_path, mimetype='audio/wav')
+    except AdmissionError as e:
+        return rejection_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -835,10 +3470,14 @@ def image_request():
             os.makedirs(temp_dir)
 
         output_path = os.path.join(temp_dir, f"{request_data['index']}.png")
-        generate_image_file(request_data['text'], output_path)
+        with generation_scheduler.admission('image', request_data['username'], uses_accelerator=True):
+            run_shared_generation(generation_cache_key('image', enhance_image_prompt(request_data['text']), **IMAGE_GENERATION_PARAMS),
+                                  lambda path: image_batcher.submit((request_data['text'], path, request_data['username'])).result(), output_path)
 
         return send_file(output_path, mimetype='image/png')
 
+    except AdmissionError as e:
+        return rejection_response(e)
     except Exception as e:
         log_to_console(f"Error in image generation request: {str(e)}", tag="GENERATE-IMAGE", spacing=1)
         return jsonify({'error': str(e)}), 500 #maybe change to wahtever idk error codes i copied jer
@@ -944,14 +3583,35 @@ def session_status():
     else:
         return jsonify({'loggedIn': False})
     
-def create_story_structure(story_content: str, data_path: str) -> dict:
+structure_streaming_supported = True # Set to False once the API rejects streaming in JSON mode so later stories skip straight to a single request
+
+def stream_story_structure(structure_request: dict, on_field: Callable[[str, Any], None]) -> str:
+    """
+    Stream the story structure completion, calling on_field with each field as soon as it is complete
+
+    Returns:
+    - The full JSON text
+    """
+    parser = StreamingJSONObjectParser()
+    content = []
+    for chunk in client.chat.completions.create(**structure_request, stream=True):
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if not token:
+            continue
+        content.append(token)
+        for key, value in parser.feed(token):
+            on_field(key, value)
+    return ''.join(content)
+
+def create_story_structure(story_content: str, data_path: str, on_field: Callable[[str, Any], None] = None) -> dict:
     """
     Create the structure for a story based on the given content
-    
+    If on_field is given the structure is streamed and on_field is called with each field (e.g. 'paragraph1') as soon as it is complete
+
     Returns:
     - The story structure as a dictionary
     """
-    json_story = client.chat.completions.create(
+    structure_request = dict(
         model = "llama-3.3-70b-specdec",
         messages = [
             {
@@ -973,10 +3633,23 @@ def create_story_structure(story_content: str, data_path: str) -> dict:
         top_p=1
     )
 
-    log_to_console(f"Generated story structure: {json_story.choices[0].message.content}", tag="GENERATE-STORY", spacing=1)
+    global structure_streaming_supported
+    content = None
+    if on_field and STREAM_STORY_STRUCTURE and structure_streaming_supported:
+        try:
+            content = stream_story_structure(structure_request, on_field)
+        except Exception as e: # Fields already reported are checked against the final structure
+            if isinstance(e, BadRequestError): # The API doesn't support streaming in JSON mode, don't try again
+                structure_streaming_supported = False
+            log_to_console(f"Could not stream story structure, falling back to a single request: {e}", tag="GENERATE-STORY", spacing=1)
+    if content is None:
+        json_story = client.chat.completions.create(**structure_request)
+        content = json_story.choices[0].message.content
+
+    log_to_console(f"Generated story structure: {content}", tag="GENERATE-STORY", spacing=1)
 
     # Save the story data to a json file
-    story_dict = json.loads(json_story.choices[0].message.content) # Parse the JSON response and get a dictionary
+    story_dict = json.loads(content) # Parse the JSON response and get a dictionary
     story_data_path = os.path.join(data_path, 'structure.json')
     with open(story_data_path, 'w') as file: # This is mainly for debugging purposes as we only need to generate the story assets once
         json.dump(story_dict, file, indent=4)
@@ -989,89 +3662,116 @@ def generate_story(data):
     username = data.get('username', None)
     story_content = data.get('content', None)
 
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        emit('story-error', {'error': 'User not found'})
+        return
+    if not story_content:
+        emit('story-error', {'error': 'No story content provided'})
+        return
+
     data_path = os.path.join(USERDATA_DIR, username, 'stories')
     data_path = os.path.join(data_path, f"{len(os.listdir(data_path)) + 1}") # Directories are enumerated 
     # Example data_path: <path to server>/static/userdata/<username>/stories/<story number>
 
-    # Create the story directory
-    os.makedirs(data_path)
+    # The story is generated by a background worker, the client follows its progress through the job's room
+    try:
+        job_id = create_generation_job(user.id, username, story_content, data_path)
+    except AdmissionError as e:
+        emit('story-error', {'error': f"{e}, please try again in {e.retry_after} seconds"})
+        return
 
-    title = 'PLACEHOLDER TITLE' # If you see this, something broke :)
+    # Create the story directory
+    os.makedirs(data_path, exist_ok=True) # The worker may have created it already
 
     log_to_console(f"Received story content: {story_content}", tag="GENERATE-STORY", spacing=1)
 
-    emit('story-progress', {'message': 'Generating story structure...'})
-    story_dict = create_story_structure(story_content, data_path)
-    title = story_dict.get('title', 'Untitled Story')
-
-    emit('story-progress', {'message': "Creating story sequence..."})
-    
-    story_sequence, audio_prompts, image_prompts = create_story_sequence(story_dict)
-
-    # Generate TTS audio files for each paragraph
-    emit('story-progress', {'message': "Generating speech..."})
-    generate_story_tts(story_sequence, data_path)
+    join_room(job_room(job_id))
+    job_available.set()
 
-    # TODO: If sound models are only loaded when needed uncomment the next line and setup the necessary logic
-    # emit('story-progress', {'message': "Loading sound model..."})
-    # LOGIC HERE
+    emit('story-progress', {'message': 'Story queued...', 'job_id': job_id})
 
-    emit('story-progress', {'message': "Generating sound effects..."})
-    generate_story_sounds(audio_prompts, data_path)
-
-    # Generate music file for the story
-    # TODO - see above re: loading music model
-    # emit('story-progress', {'message': "Loading music model..."})
-    # LOGIC HERE
-
-    emit('story-progress', {'message': "Generating music..."})
-    generate_story_music(story_dict, data_path)
-
-    # Generate images
-    emit('story-progress', {'message': "Generating images..."})
-    generate_story_images(image_prompts, story_dict, data_path)
-
-    emit('story-progress', {'message': "Committing story data..."})
+@socketio.on('subscribe-job')
+def subscribe_job(data):
+    """Subscribe to the updates of a job (e.g. after reconnecting), only the logged in owner of the job can subscribe"""
+    username = session.get('username', None)
+    if username is None:
+        emit('story-error', {'error': 'You must be logged in to follow a job'})
+        return
 
-    save_paragraphs(story_sequence, data_path)
-    
-    story_num = add_story_to_db(title=title, data_path=data_path, isPublic=False, user_id=User.query.filter_by(username=username).first().id)
-    emit('story-complete', {'message': 'Story generated successfully!', 'title': title, 'url': f'/story-{story_num}'})
+    try:
+        job_data = get_job_data(int(data.get('job_id')))
+    except (TypeError, ValueError):
+        job_data = None
+
+    if job_data is None or job_data['username'] != username:
+        emit('story-error', {'error': 'Job not found'})
+        return
+
+    join_room(job_room(job_data['job_id']))
+    if job_data['status'] == 'complete':
+        emit('story-complete', {'message': job_data['message'], 'url': job_data['url'], 'job_id': job_data['job_id']})
+    elif job_data['status'] == 'failed':
+        emit('story-error', {'error': job_data['error'], 'job_id': job_data['job_id']})
+    else:
+        emit('story-progress', {'message': job_data['message'], 'job_id': job_data['job_id']})
 
-@app.route('/get-audio', methods=['POST'])
-def get_audio():
-    data = request.json
-    data_path = data.get('data_path')
-    next_audio = data.get('file')
+@app.route('/job-status/<int:job_id>', methods=['GET'])
+def job_status(job_id):
+    job_data = get_job_data(job_id)
+    if job_data is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job_data['username'] != session.get('username', None):
+        return jsonify({'error': 'You do not have permission to access this job'}), 403
 
-    log_to_console(f"Received request for audio file: {data_path}, {next_audio}", tag="GET-AUDIO", spacing=1)
+    return jsonify(job_data), 200
 
-    if not data_path or not next_audio:
-        return jsonify({'error': 'Missing data path or audio file index'}), 400
-    
-    path = os.path.join(USERDATA_DIR, data_path)
-    # Try get audio file
-    for file in os.listdir(path):
-        if file.startswith(next_audio):
-            return send_file(os.path.join(path, file), mimetype='audio/wav')
-        
-    return jsonify({'error': 'Audio file not found'}), 404
-    
+# NOTE: Kept for older clients, the story viewer uses the cacheable /story-audio route
 @app.route('/regenerate', methods=['POST'])
 def regenerate_story_route():
-    
+    """
+    Queue a job that regenerates the assets of a story and return its ID immediately
+    The request can include a list of 'assets' (e.g. ["image_3"]) or 'missing': true to only replace missing and corrupt files,
+    progress is sent to the job's Socket.IO room (see subscribe-job) and can be polled from /job-status
+    """
     try:
         data = request.json
         storyID = int(data.get('storyID'))
         story_data = get_story_data(storyID)
-    except ValueError:
+    except (TypeError, ValueError):
         return jsonify({'error': 'Invalid story ID'}), 400
-    
-    log_to_console(f"Regenerating story: {story_data['title']}", tag="REGENERATE-STORY", spacing=1)
 
-    regenerate_story(story_data['data_path'])
+    if story_data['username'] != session.get('username', None):
+        return jsonify({'error': 'You do not have permission to regenerate this story'}), 403
+
+    if data.get('missing', False):
+        target_assets = 'missing'
+    elif data.get('assets'):
+        target_assets = data.get('assets')
+        if not isinstance(target_assets, list) or not all(isinstance(asset, str) for asset in target_assets):
+            return jsonify({'error': 'Assets must be a list of asset names'}), 400
+        try:
+            with open(os.path.join(story_data['data_path'], 'structure.json'), 'r') as file:
+                invalid_assets = sorted(set(target_assets) - set(get_story_asset_names(json.load(file))))
+        except FileNotFoundError:
+            return jsonify({'error': 'Story data not found'}), 404
+        if invalid_assets:
+            return jsonify({'error': f"Unknown assets: {', '.join(invalid_assets)}", 'invalid_assets': invalid_assets}), 400
+    else:
+        target_assets = None
+
+    log_to_console(f"Queueing regeneration of story: {story_data['title']} ({target_assets or 'all assets'})", tag="REGENERATE-STORY", spacing=1)
 
-    return jsonify({'message': 'Story regenerated successfully'}), 200
+    user = User.query.filter_by(username=story_data['username']).first()
+    try:
+        job_id = create_regeneration_job(user.id, user.username, storyID, story_data['data_path'], target_assets)
+    except AdmissionError as e:
+        return rejection_response(e)
+    if job_id is None:
+        return jsonify({'error': 'The story is already being regenerated, try again once it has finished'}), 409
+    job_available.set()
+
+    return jsonify({'message': 'Story regeneration queued', 'job_id': job_id, 'status_url': url_for('job_status', job_id=job_id)}), 202
 
 @app.route('/toggle-public', methods=['POST'])
 def toggle_public():
@@ -1087,6 +3787,38 @@ def toggle_public():
 
     return jsonify({'message': 'Story privacy toggled successfully'}), 200
 
+@app.route('/model-stats', methods=['GET'])
+def model_stats():
+    return jsonify({**model_registry.stats(), 'batchers': {batcher.name: batcher.stats() for batcher in (tts_batcher, image_batcher)}}), 200
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({**generation_cache.stats(), 'in_flight': single_flight.stats()}), 200
+
+@app.route('/scheduler-stats', methods=['GET'])
+def scheduler_stats():
+    return jsonify(generation_scheduler.stats()), 200
+
+@app.route('/startup-report', methods=['GET'])
+def startup_report():
+    return jsonify(get_startup_report()), 200
+
+# Routes that need the models, these are rejected in web only mode
+GENERATION_ENDPOINTS = ['tts_request', 'sound_effect_request', 'image_request']
+
+@app.before_request
+def reject_generation_in_web_only_mode():
+    if WEB_ONLY and request.endpoint in GENERATION_ENDPOINTS:
+        return jsonify({'error': 'Generation is not available on this server'}), 503
+
+# Routes that expose server internals, only available to the users in ADMIN_USERS
+ADMIN_ENDPOINTS = ['model_stats', 'scheduler_stats']
+
+@app.before_request
+def require_admin_for_server_stats():
+    if request.endpoint in ADMIN_ENDPOINTS and session.get('username', None) not in ADMIN_USERS:
+        return jsonify({'error': 'You do not have permission to view this page'}), 403
+
 #-----------------------------------------------------Error Handling-----------------------------------------------------#
 
 # Page to display when content is not found
@@ -1149,6 +3881,7 @@ def clear_stories():
     stories = Story.query.all()
     for story in stories:
         db.session.delete(story)
+    GenerationJob.query.delete()
     db.session.commit()
 
     # Clear all story files for all users
@@ -1183,6 +3916,9 @@ def delete_folder(path: str) -> None:
 
 # Flag to delete all stories from the database on server start
 DELETE_STORIES = False
+BACKFILL_DERIVATIVES_ON_START = True # Flag to create missing image derivatives for existing stories on server start
+BACKFILL_STORY_METADATA_ON_START = True # Flag to store the catalogue data of older stories in the database on server start
+ENCODE_EXISTING_AUDIO_ON_START = False # Flag to encode the audio of existing stories in the background on server start (migration)
 CLEAR_TEMP_ON_START = True # Flag to clear all temporary files on server start
 # NOTE: The Debug flag is set at the top of the file, while I would like to place it here it used for processes that are defined before this point
 
@@ -1190,7 +3926,9 @@ if __name__ == '__main__':
     if not os.path.exists(USERDATA_DIR):
         os.makedirs(USERDATA_DIR)
 
+    clock = time.perf_counter()
     init_db()
+    STARTUP_TIMINGS['initialise database'] = time.perf_counter() - clock
 
     if CLEAR_TEMP_ON_START:
         clear_all_temp_files()
@@ -1201,5 +3939,19 @@ if __name__ == '__main__':
         delete_redundant_users()
         if DELETE_STORIES:
             clear_stories()
+        if BACKFILL_DERIVATIVES_ON_START:
+            backfill_image_derivatives()
+        if BACKFILL_STORY_METADATA_ON_START:
+            backfill_story_metadata()
+        if ENCODE_EXISTING_AUDIO_ON_START:
+            encode_existing_story_audio()
+
+    if WEB_ONLY:
+        log_to_console("Running in web only mode, models will not be loaded", tag="STARTUP", spacing=1)
+    else:
+        start_job_workers()
+
+    STARTUP_TIMINGS['total'] = time.perf_counter() - startup_clock
+    report_startup_times()
 
     app.run(debug=DEBUG)
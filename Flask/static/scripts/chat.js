@@ -9,10 +9,13 @@ var imagesGenerated = []; // avoid generating multiple images for the same respo
 let pendingImageGenerations = new Map();
 
 var audio = new Audio();
+var streamContext = null; // AudioContext used to play streamed TTS
+var streamPlaying = false;
 
 var generated = []; // Used to avoid generating the same audio multiple times
 
 const socket = io();
+var currentJobId = localStorage.getItem('storyJobId'); // Story generation job to follow (survives page reloads)
 
 document.addEventListener("DOMContentLoaded", async function (event) {
     outputDiv = document.getElementById('output');
@@ -21,6 +24,7 @@ document.addEventListener("DOMContentLoaded", async function (event) {
     await userOnPageLoad();
 
     setupPrompt();
+    subscribeToStoryJob();
 });
 
 function setupPrompt() {
@@ -133,14 +137,14 @@ async function executePrompt() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ prompt })
+            body: JSON.stringify({ prompt, stream: true })
         });
 
-        const result = await response.json();
+        const modelResponse = responseContainer.querySelector('.model-response');
+        const result = await readPromptResponse(response, modelResponse);
 
         if (result.success && result.reply) {
-            // Update the response text
-            const modelResponse = responseContainer.querySelector('.model-response');
+            // Update the response text (the streamed tokens are replaced by the assembled reply)
             modelResponse.textContent = result.reply;
 
             // Now add the image container and start image generation
@@ -170,6 +174,46 @@ async function executePrompt() {
     window.scrollTo(0, document.body.scrollHeight);
 }
 
+async function readPromptResponse(response, modelResponse) {
+    // Streamed replies arrive as server-sent events, errors (e.g. an unsafe prompt) are still returned as JSON
+    if (!response.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+        return await response.json();
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += value;
+
+        // Events are separated by a blank line
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of message.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+
+            const payload = JSON.parse(data);
+            if (event === 'done') {
+                return { success: true, reply: payload.reply };
+            }
+            if (event === 'error') {
+                return { success: false, error: payload.error };
+            }
+            modelResponse.textContent += payload.token;
+            window.scrollTo(0, document.body.scrollHeight);
+        }
+    }
+    return { success: false, error: 'The reply ended unexpectedly' };
+}
+
 async function generateStory(parentDiv) {
     if (generatingStory) {
         console.log('Already generating a story, please wait.');
@@ -189,13 +233,38 @@ async function generateStory(parentDiv) {
 
 }
 
+function setStoryJob(jobId) {
+    currentJobId = jobId;
+    if (jobId === null) {
+        localStorage.removeItem('storyJobId');
+    }
+    else {
+        localStorage.setItem('storyJobId', jobId);
+    }
+}
+
+// Follow an unfinished story job, the story keeps generating on the server while the page is closed or disconnected
+function subscribeToStoryJob() {
+    if (currentJobId === null || !loggedIn) return;
+    generatingStory = true;
+    socket.emit('subscribe-job', { job_id: currentJobId, username: user });
+}
+
+socket.on('connect', () => {
+    subscribeToStoryJob();
+});
+
 socket.on('story-progress', (data) => {
+    if (data.job_id !== undefined) {
+        setStoryJob(data.job_id);
+    }
     outputDiv.innerHTML += `<p>${data.message}</p>`;
 });
 
 socket.on('story-error', (data) => {
     outputDiv.innerHTML += `<p style="color: red;" class = model-error>Error: ${data.error}</p>`;
     generatingStory = false;
+    setStoryJob(null);
 });
 
 socket.on('story-complete', (data) => {
@@ -204,6 +273,7 @@ socket.on('story-complete', (data) => {
     `;
 
     generatingStory = false;
+    setStoryJob(null);
 
     outputDiv.innerHTML += `
         <p>Redirecting in...</p>
@@ -273,6 +343,7 @@ async function playAudio(parentDiv) {
                 username: user,
                 index: index,
                 alreadyGenerated: shouldExist,
+                stream: !shouldExist,
             })
         });
 
@@ -282,6 +353,12 @@ async function playAudio(parentDiv) {
 
         generated.push(index);
 
+        if (!shouldExist) {
+            // Sentences are played as soon as they arrive instead of waiting for the whole file
+            await playAudioStream(response);
+            return;
+        }
+
         const audioBlob = await response.blob();
         const audioUrl = URL.createObjectURL(audioBlob);
         audio = new Audio(audioUrl);
@@ -299,9 +376,75 @@ async function playAudio(parentDiv) {
     }
 }
 
+async function playAudioStream(response) {
+    // Play a streamed 16-bit mono WAV: a 44 byte header followed by PCM chunks
+    const reader = response.body.getReader();
+    const minChunkBytes = 8000; // Avoid scheduling lots of tiny buffers
+    let pending = new Uint8Array(0);
+    let sampleRate = null;
+    let nextStartTime = 0;
+    let lastSource = null;
+
+    if (!streamContext) {
+        streamContext = new AudioContext();
+    }
+    streamPlaying = true;
+
+    const schedule = (bytes) => {
+        const samples = new Int16Array(bytes.buffer, bytes.byteOffset, bytes.byteLength / 2);
+        const buffer = streamContext.createBuffer(1, samples.length, sampleRate);
+        const channel = buffer.getChannelData(0);
+        for (let i = 0; i < samples.length; i++) {
+            channel[i] = samples[i] / 32768;
+        }
+
+        const source = streamContext.createBufferSource();
+        source.buffer = buffer;
+        source.connect(streamContext.destination);
+        nextStartTime = Math.max(nextStartTime, streamContext.currentTime);
+        source.start(nextStartTime);
+        nextStartTime += buffer.duration;
+        lastSource = source;
+    };
+
+    try {
+        while (true) {
+            const { done, value } = await reader.read();
+            if (value) {
+                const merged = new Uint8Array(pending.length + value.length);
+                merged.set(pending);
+                merged.set(value, pending.length);
+                pending = merged;
+            }
+
+            if (sampleRate === null && pending.length >= 44) {
+                sampleRate = new DataView(pending.buffer, pending.byteOffset).getUint32(24, true);
+                pending = pending.slice(44);
+            }
+
+            // Only whole samples can be scheduled, keep any odd byte for the next chunk
+            const ready = pending.length - (pending.length % 2);
+            if (sampleRate !== null && ready > 0 && (done || ready >= minChunkBytes)) {
+                schedule(pending.slice(0, ready));
+                pending = pending.slice(ready);
+            }
+
+            if (done) break;
+        }
+    }
+    finally {
+        if (lastSource) {
+            lastSource.onended = () => { streamPlaying = false; };
+        }
+        else {
+            streamPlaying = false;
+        }
+    }
+}
+
 function isAudioPlaying() {
     console.log('audio.paused: ' + audio.paused);
-    return !audio.paused;
+    return !audio.paused || streamPlaying;
 }
 
 function stopAudio() {
@@ -1,24 +1,103 @@
 
+var loadingStories = false;
+
 document.addEventListener("DOMContentLoaded", async function (event) {
     await userOnPageLoad();
     setupStorySelection();
+    setupInfiniteScroll();
     
 });
 
 function setupStorySelection() {
     document.querySelectorAll(".story-preview").forEach(story => {
-        story.addEventListener("click", function () {
-            const url = this.getAttribute("target_url");
-            if (url) {
-                console.log("Redirecting to:", url);
-                window.location.href = url;
-            } else {
-                console.error("No URL found!");
-            }
-        });
+        addStorySelection(story);
+    });
+}
+
+function addStorySelection(story) {
+    story.addEventListener("click", function () {
+        const url = this.getAttribute("target_url");
+        if (url) {
+            console.log("Redirecting to:", url);
+            window.location.href = url;
+        } else {
+            console.error("No URL found!");
+        }
     });
 }
 
+function setupInfiniteScroll() {
+    const loader = document.getElementById("stories-loader");
+    const container = document.getElementById("stories-container");
+    if (!loader || !container.getAttribute("next_cursor")) {
+        return; // Everything is already on the page
+    }
+
+    const observer = new IntersectionObserver(async (entries) => {
+        if (!entries[0].isIntersecting || loadingStories) return;
+
+        await loadMoreStories();
+        if (!container.getAttribute("next_cursor")) {
+            observer.disconnect();
+        }
+    }, { rootMargin: "400px" }); // Start loading before the user reaches the bottom
+
+    observer.observe(loader);
+}
+
+async function loadMoreStories() {
+    const container = document.getElementById("stories-container");
+    const cursor = container.getAttribute("next_cursor");
+    if (!cursor) return;
+
+    loadingStories = true;
+    try {
+        const response = await fetch(`/public-stories-page?cursor=${encodeURIComponent(cursor)}`);
+
+        if(!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const data = await response.json();
+        data.stories.forEach(story => {
+            container.appendChild(createStoryPreview(story));
+        });
+        container.setAttribute("next_cursor", data.next_cursor === null ? "" : data.next_cursor);
+    }
+    catch (error) {
+        console.error('Error:', error);
+    }
+    finally {
+        loadingStories = false;
+    }
+}
+
+function createStoryPreview(story) {
+    const preview = document.createElement("div");
+    preview.className = "story-preview";
+    preview.setAttribute("target_url", story.url);
+
+    const thumbnail = document.createElement("img");
+    thumbnail.src = story.thumbnail;
+    thumbnail.alt = story.title;
+    thumbnail.className = "story-thumbnail";
+    thumbnail.loading = "lazy";
+    preview.appendChild(thumbnail);
+
+    const title = document.createElement("h2");
+    title.textContent = story.title;
+    preview.appendChild(title);
+
+    if (story.author) {
+        const author = document.createElement("p");
+        author.textContent = "by " + story.author;
+        preview.appendChild(author);
+    }
+
+    addStorySelection(preview);
+    return preview;
+}
+
 function redirectToStory(url) {
     console.long('Redirecting to ' + url);
 }
@@ -3,10 +3,12 @@ var audio = new Audio();
 var listening = false;
 var currentIndex = 1;
 var soundEffectNext = false;
-var global_data_path = '';
 var inTimeout = true;
 var music = new Audio();
 
+// Stream the compressed audio if the browser can play it
+const audioFormat = new Audio().canPlayType('audio/ogg; codecs=opus') ? 'opus' : 'wav';
+
 const textColour = "#ececec";
 const highlightColour = "#f0f0f0";
 const highlightBackgroundColour = "#000000";
@@ -32,6 +34,15 @@ function highlightNextParagraph(){
     storyTexts[highlightIndex].style.backgroundColor = highlightBackgroundColour;
 }
 
+function highlightParagraph(paragraph){
+    const storyTexts = document.getElementsByClassName('story-text');
+    for(let i = 0; i < storyTexts.length; i++){
+        const highlighted = i === paragraph - 1;
+        storyTexts[i].style.color = highlighted ? highlightColour : textColour;
+        storyTexts[i].style.backgroundColor = highlighted ? highlightBackgroundColour : "transparent";
+    }
+}
+
 document.addEventListener("DOMContentLoaded", async function (event) {
     await userOnPageLoad();
 });
@@ -63,7 +74,41 @@ async function togglePublic(isPublic){
     }
 }
 
-async function regenerateStory(){
+const socket = io();
+var regenerationJobId = null; // Regeneration job being followed
+
+socket.on('story-progress', (data) => {
+    if (data.job_id === regenerationJobId) {
+        setRegenerationStatus(data.message);
+    }
+});
+
+socket.on('story-error', (data) => {
+    if (data.job_id === regenerationJobId) {
+        setRegenerationStatus(`Error: ${data.error}`);
+        regenerationJobId = null;
+    }
+});
+
+socket.on('story-complete', (data) => {
+    if (data.job_id === regenerationJobId) {
+        // Refresh to load the new assets
+        location.reload();
+    }
+});
+
+function setRegenerationStatus(message) {
+    const regenerateButton = document.getElementById('regenerate-button');
+    regenerateButton.innerText = message;
+}
+
+async function regenerateStory(options = {}){
+    // options can contain a list of assets (e.g. { assets: ['image_3'] }) or { missing: true }, every asset is regenerated otherwise
+    if (regenerationJobId !== null) {
+        console.log('Regeneration already in progress');
+        return;
+    }
+
     try {
         const response = await fetch('/regenerate', {
             method: 'POST',
@@ -71,36 +116,42 @@ async function regenerateStory(){
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
-                storyID: getStoryID()
+                storyID: getStoryID(),
+                ...options
             })
         });
 
+        if (response.status === 409) {
+            // Another regeneration of the story is running, it has to finish first
+            setRegenerationStatus((await response.json()).error);
+            return;
+        }
         if(!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
+        // Regeneration runs in the background, follow its progress
         const data = await response.json();
-        // Refresh if successful
-        location.reload();
+        regenerationJobId = data.job_id;
+        setRegenerationStatus(data.message);
+        socket.emit('subscribe-job', { job_id: regenerationJobId, username: user });
     }
     catch (error) {
         console.error('Error:', error);
     }
 }
 
-function playAudio(data_path) {
+function playAudio() {
     if (isAudioPlaying()) {
         console.log('Button disabled because audio is already playing');
         return;
     }
 
-    
-    // NOTE: data_path should be received in the form '<username>/stories/<story_id>'
-
-    global_data_path = data_path;
-
-    console.log("Data path: " + data_path);
-    // Do something
+    // Stories with a pre-mixed soundtrack are played as a single file, older stories play each clip in turn
+    if (storyAudio['soundtrack'] && storyTimeline) {
+        playSoundtrack();
+        return;
+    }
 
     listening = true;
     transitionToNextAudio();
@@ -108,6 +159,35 @@ function playAudio(data_path) {
     window.requestAnimationFrame(loop); // Start the loop
 }
 
+async function playSoundtrack() {
+    audio = new Audio(`${storyAudio['soundtrack']}&format=${audioFormat}`);
+
+    // Highlight the paragraph being narrated, the previous one stays highlighted during its sound effect
+    audio.addEventListener('timeupdate', () => {
+        const segment = storyTimeline.segments.find(segment => segment.type === 'narration' && audio.currentTime >= segment.start && audio.currentTime < segment.end);
+        if (segment) {
+            highlightParagraph(segment.paragraph);
+        }
+    });
+
+    audio.addEventListener('ended', () => {
+        console.log('End of story');
+        highlightParagraph(0);
+        music.pause();
+    });
+
+    if (!storyTimeline.music) {
+        requestMusic();
+    }
+
+    try {
+        await audio.play();
+    }
+    catch (error) {
+        console.error('Error:', error);
+    }
+}
+
 function getMaxIndex() {
     // Get max index by counting the number of paragraphs
     // Count amount of dom elements with class 'story-text'
@@ -152,28 +232,16 @@ async function transitionToNextAudio() {
 }
 
 async function requestAudio(nextAudio) {
-    
+    // The audio is streamed from a cacheable URL so playback starts before the whole file has downloaded
+    const audioUrl = storyAudio[nextAudio];
+    if (!audioUrl) {
+        console.error('No audio found for ' + nextAudio);
+        return;
+    }
 
     try {
-        const response = await fetch('/get-audio', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                data_path: global_data_path,
-                file: nextAudio
-            })
-        });
-
-        if(!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-
-        const audioBlob = await response.blob();
-        const audioUrl = URL.createObjectURL(audioBlob);
-        audio = new Audio(audioUrl);
-        audio.play();
+        audio = new Audio(`${audioUrl}&format=${audioFormat}`);
+        await audio.play();
     }
     catch (error) {
         console.error('Error:', error);
@@ -181,29 +249,18 @@ async function requestAudio(nextAudio) {
 }
 
 async function requestMusic() {
-    try {
-        const response = await fetch('/get-audio', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                data_path: global_data_path,
-                file: 'music'
-            })
-        });
-
-        if(!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
+    const musicUrl = storyAudio['music'];
+    if (!musicUrl) {
+        console.error('No music found');
+        return;
+    }
 
-        const audioBlob = await response.blob();
-        const audioUrl = URL.createObjectURL(audioBlob);
-        music = new Audio(audioUrl);
+    try {
+        music = new Audio(`${musicUrl}&format=${audioFormat}`);
         // Lower the volume
         music.volume = 0.1;
         music.loop = true;
-        music.play();
+        await music.play();
     }
     catch (error) {
         console.error('Error:', error);